@@ -0,0 +1,214 @@
+import asyncio
+import secrets
+
+import dns.message
+
+from DNS.event_log import log, WARNING
+from DNS.packet_filter import OK
+from DNS.response_cache import NegativeAnswer
+from DNS.wire_codec import same_question
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    """UDP endpoint to one backend that keeps many queries in flight at once.
+
+    Every forwarded query gets a random upstream message ID so that clients which
+    happen to pick the same ID don't collide; replies are matched back by that ID and
+    must repeat the question, anything else is dropped.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}  # {upstream_id: (future, query wire)}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        upstream_id = int.from_bytes(data[:2], "big")
+        pending = self.pending.get(upstream_id)
+        if pending is None or not same_question(pending[1], data):
+            return
+        del self.pending[upstream_id]
+        if not pending[0].done():
+            pending[0].set_result(data)
+
+    def error_received(self, exc):
+        log.warning("upstream_error", "Upstream error: {}", exc)
+
+    def connection_lost(self, exc):
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("upstream endpoint closed"))
+        self.pending.clear()
+
+    def allocate_id(self):
+        if len(self.pending) >= 65536:
+            raise RuntimeError("Too many upstream queries in flight")
+        while True:
+            upstream_id = secrets.randbelow(65536)
+            if upstream_id not in self.pending:
+                return upstream_id
+
+    async def query(self, wire, timeout):
+        upstream_id = self.allocate_id()
+        future = asyncio.get_running_loop().create_future()
+        wire = upstream_id.to_bytes(2, "big") + wire[2:]
+        self.pending[upstream_id] = (future, wire)
+        self.transport.sendto(wire)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(upstream_id, None)
+
+
+class GatekeeperProtocol(asyncio.DatagramProtocol):
+    """Client-facing side of the asyncio engine.
+
+    validate() runs inline for every packet, exactly like the threaded loop, so bans
+    behave the same; everything after that runs as its own task.
+
+    A query for a (qname, qtype, qclass) that is already being forwarded isn't sent
+    upstream again: it waits for the reply to the first one and gets a copy of it
+    under its own ID, so upstream load is bounded by the number of distinct names.
+    """
+
+    def __init__(self, gatekeeper, upstreams, timeout):
+        self.gatekeeper = gatekeeper
+        self.upstreams = upstreams  # {Backend: UpstreamProtocol}
+        self.timeout = timeout
+        self.transport = None
+        self.inflight = {}  # {(qname, qtype, qclass): future of the upstream reply}
+        self.coalesced = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.gatekeeper.packet_filter.check(data, len(data)) != OK:
+            return
+        if not self.gatekeeper.validate(addr[0]):
+            self.gatekeeper.blocked(addr, data, self.transport.sendto)
+            return
+
+        asyncio.get_running_loop().create_task(self.handle(data, addr))
+
+    async def handle(self, data, addr):
+        try:
+            request = dns.message.from_wire(data)
+
+            if hasattr(request, 'update') and len(request.update):
+                # Updates are rare, keep using the blocking path off the event loop
+                reply = await asyncio.get_running_loop().run_in_executor(None, self.gatekeeper.add_record, request)
+                self.transport.sendto(self.gatekeeper.make_response(request, reply).to_wire(), addr)
+                return
+
+            question = request.question[0]
+            cache_key = (question.name, question.rdtype, question.rdclass)
+            cached = self.gatekeeper.cache.get(cache_key)
+            if cached is None:
+                cached = self.gatekeeper.negative_cache.get(cache_key)
+            if cached is not None:
+                if self.gatekeeper.allow(addr, data, question.name, cached, self.transport.sendto):
+                    self.transport.sendto(self.gatekeeper.make_response(request, cached).to_wire(), addr)
+                return
+
+            reply_wire, reply, shared = await self.forward_shared(cache_key, data)
+
+            if shared:
+                # The question has the same length in every query for this key, only the case
+                # of the name may differ, so the client's own question is put back in
+                end = 12 + len(question.name.to_wire()) + 4
+                if reply_wire[4:6] == b"\x00\x01":
+                    reply_wire = reply_wire[:12] + data[12:end] + reply_wire[end:]
+            allowed = self.gatekeeper.allow(addr, data, question.name, reply, self.transport.sendto)
+        except asyncio.TimeoutError:
+            log.count(WARNING, "upstream_timeout", "upstream", "{count:,} queries timed out {key} in last {interval:g}s")
+            return
+        except Exception as e:
+            log.warning("query_error", "DNS ERROR: {}", e)
+            return
+
+        if allowed:
+            # Relay the upstream answer under the client's own query ID
+            self.transport.sendto(data[:2] + reply_wire[2:], addr)
+
+    async def forward_shared(self, key, data):
+        # (reply wire, answer rrset/NegativeAnswer/None, True if it is the reply to another
+        # client's identical query)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            reply_wire, reply = await asyncio.shield(future)
+            return reply_wire, reply, True
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            reply_wire = await self.forward_query(data)
+
+            message = dns.message.from_wire(reply_wire)
+            reply = NegativeAnswer.from_reply(message)
+            if reply is not None:
+                self.gatekeeper.negative_cache.put(key, reply)
+            elif len(message.answer):
+                reply = list(message.answer)
+                self.gatekeeper.cache.put(key, reply)
+
+            future.set_result((reply_wire, reply))
+            return reply_wire, reply, False
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # don't warn about it when nobody was waiting
+            raise
+        finally:
+            del self.inflight[key]
+            if not future.done():
+                future.cancel()
+
+    async def forward_query(self, data):
+        selector = self.gatekeeper.selector
+        error = None
+        tried = []
+        for _ in range(self.gatekeeper.retries + 1):
+            backend = selector.choose(exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+
+            started = selector.start(backend)
+            try:
+                reply_wire = await self.upstreams[backend].query(data, self.timeout)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                selector.failure(backend, started)
+                error = e
+                continue
+            except BaseException:
+                # Still count it against the backend, or it stays outstanding for good
+                selector.failure(backend, started)
+                raise
+            selector.success(backend, started)
+            return reply_wire
+
+        raise error
+
+
+async def serve(gatekeeper, timeout=2.0):
+    loop = asyncio.get_running_loop()
+
+    upstreams = {}
+    for backend in gatekeeper.selector.backends:
+        _, upstreams[backend] = await loop.create_datagram_endpoint(UpstreamProtocol,
+                                                                    remote_addr=(backend.host, backend.port))
+
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: GatekeeperProtocol(gatekeeper, upstreams, timeout), sock=gatekeeper.socket)
+
+    try:
+        await loop.create_future()  # serve until cancelled
+    finally:
+        transport.close()
+        for upstream in upstreams.values():
+            upstream.transport.close()
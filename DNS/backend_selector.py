@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+
+from DNS.event_log import log
+
+
+class Backend:
+    """One upstream nameserver plus the passive health/latency stats used to pick it."""
+
+    def __init__(self, name, host, port, client):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.client = client
+
+        self.ewma_latency = 0.0  # seconds, 0 until the first answer so new backends get tried
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        return now >= self.ejected_until
+
+    def cost(self):
+        # Expected wait if we queue behind everything already in flight
+        return self.ewma_latency * (self.outstanding + 1)
+
+
+class RandomStrategy:
+    def choose(self, backends):
+        return random.choice(backends)
+
+
+class RoundRobinStrategy:
+    def __init__(self):
+        self.counter = 0
+
+    def choose(self, backends):
+        self.counter += 1
+        return backends[self.counter % len(backends)]
+
+
+class PowerOfTwoStrategy:
+    # Sample two backends and keep the cheaper one; with only two backends this
+    # is simply "least loaded, latency weighted"
+    def choose(self, backends):
+        if len(backends) == 1:
+            return backends[0]
+        first, second = random.sample(backends, 2)
+        return first if first.cost() <= second.cost() else second
+
+
+STRATEGIES = {
+    'p2c': PowerOfTwoStrategy,
+    'round_robin': RoundRobinStrategy,
+    'random': RandomStrategy,
+}
+
+
+class BackendSelector:
+    def __init__(self, backends, strategy='p2c', alpha=0.3, max_failures=3, eject_duration=30):
+        self.backends = backends
+        self.strategy = STRATEGIES[strategy]() if isinstance(strategy, str) else strategy
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.eject_duration = eject_duration
+        # start/success/failure are called from every resolve worker
+        self.lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+
+        healthy = [b for b in candidates if b.available(now)]
+        if healthy:
+            return self.strategy.choose(healthy)
+
+        # Everything is ejected: rather than dropping the query, try whoever comes back first
+        return min(candidates, key=lambda b: b.ejected_until)
+
+    def start(self, backend):
+        with self.lock:
+            backend.outstanding += 1
+        return time.monotonic()
+
+    def success(self, backend, started):
+        with self.lock:
+            backend.outstanding -= 1
+            self.observe(backend, time.monotonic() - started)
+            backend.consecutive_failures = 0
+
+    def failure(self, backend, started):
+        with self.lock:
+            backend.outstanding -= 1
+            # A timeout counts as a very slow answer so the backend's cost goes up straight away
+            self.observe(backend, time.monotonic() - started)
+            backend.consecutive_failures += 1
+            ejected = backend.consecutive_failures >= self.max_failures
+            if ejected:
+                backend.ejected_until = time.monotonic() + self.eject_duration
+                backend.consecutive_failures = 0
+        if ejected:
+            log.warning("backend", "Ejecting backend {} for {}s", backend.name, self.eject_duration)
+
+    def observe(self, backend, latency):
+        if backend.ewma_latency == 0.0:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency = self.alpha * latency + (1 - self.alpha) * backend.ewma_latency
+
+    def stats(self):
+        return {b.name: {"ewma_latency": b.ewma_latency, "outstanding": b.outstanding,
+                         "ejected": not b.available(time.monotonic())} for b in self.backends}
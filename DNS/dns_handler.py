@@ -1,11 +1,14 @@
 import argparse
-import copy
+import itertools
+import threading
 
 import dns.message
 import dns.resolver
 import dns.zone
 import dns.query
 import dns.dnssec
+import dns.rdataset
+import dns.renderer
 from dns.zone import Zone
 
 
@@ -13,12 +16,30 @@ from dns.exception import ValidationFailure
 
 from cryptography.hazmat.primitives import serialization
 
+from DNS.event_log import log
+from DNS.ixfr_journal import IXFRJournal
+from DNS.forwarder_cache import ForwarderCache
+from DNS.response_cache import NegativeAnswer
+from DNS.signature_cache import SignatureCache
+from DNS.upstream_client import UpstreamClient
+from DNS.zone_update import ZoneUpdate
+from DNS.wire_codec import FAST_TYPES, encode_answer, plain_query_end, question_end
+from DNS.zone_validator import ZoneValidator, pair_signatures
+from DNS.zone_journal import ZoneJournal
+from DNS.zone_index import ZoneIndex, wire_key, ANSWER, WILDCARD, NODATA, NXDOMAIN, OUT_OF_ZONE
+
 
 class MyDNSHandler:
-    def __init__(self, forwarding_server, zone_file_path, private_key_path):
+    def __init__(self, forwarding_server, zone_file_path, private_key_path, validation_workers=None):
         self.forwarding_server = forwarding_server
+        self.forwarder = UpstreamClient(forwarding_server, 53)
         self.zone_file_path = zone_file_path
         self.zone = dns.zone.from_file(self.zone_file_path, relativize=False)
+        # Changes made since the zone file was last written are in its journal
+        self.zone_journal = ZoneJournal(self.zone_file_path)
+        replayed = self.zone_journal.replay(self.zone)
+        if replayed:
+            log.info("journal", "Replayed {} journal entries onto {}", replayed, self.zone_file_path)
         with open(private_key_path, "rb") as key_file:
             self.private_key = serialization.load_pem_private_key(
                 key_file.read(),
@@ -31,75 +52,292 @@ class MyDNSHandler:
         self.public_key = dns.dnssec.make_dnskey(self.private_key.public_key(), 8)
         zrds.add(self.public_key)
 
-    def resolve(self, request):
-        query_name = str(request.question[0].name)
-        query_type = dns.rdatatype.to_text(request.question[0].rdtype)
+        # RRSIGs reused across transfers, re-signed only when an rrset changes or nears expiry
+        self.signatures = SignatureCache(self.private_key, self.public_key, self.zone.origin)
+        self.signatures.start_refresher()
+
+        # Process pool for checking the signatures of whole transferred zones
+        self.validator = ZoneValidator(validation_workers)
+
+        # Flat (name, rdtype) index over the zone, compiled once here and kept up to date on changes
+        self.index = ZoneIndex(self.zone)
+
+        # Rendered responses for names in the zone, negative ones included, cleared whenever
+        # the zone changes.
+        # {(lowercase wire qname + qtype + qclass): (flags, rcode, section counts, sections after the question)}
+        self.answer_cache = {}
+        # Bumped with every clear; an answer rendered from an older zone isn't stored
+        self.answer_generation = 0
+        self.answer_lock = threading.Lock()
+        # Answers from the forwarder for names outside the zone, negative ones kept for their
+        # SOA minimum (RFC 2308); popular names are prefetched and expired ones served stale
+        self.forward_cache = ForwarderCache(lambda wire: self.forward_query(None, wire))
+
+        # Held while committing a change and while a transfer captures the zone
+        self.zone_lock = threading.Lock()
+        # Held for a whole update or incoming transfer, from reading the SOA to the commit
+        self.update_lock = threading.Lock()
+
+        # Diffs made by add_record, one per SOA serial, to answer IXFR with
+        self.journal = IXFRJournal()
+        # Primary's DNSKEY, learned from the last full transfer; incremental transfers are validated against it
+        self.primary_key = None
+
+    def handle_request(self, request, data=None):
+        if data is None:
+            data = request.to_wire()
+
+        cached = self.cached_response(data, request)
+        if cached is not None:
+            return cached
+
+        reply = self.resolve(request, data)
+
+        if not (hasattr(request, 'update') and len(request.update)) and \
+                request.question[0].rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            return reply
+
+        if isinstance(reply, NegativeAnswer):
+            return reply.to_response(request).to_wire()
+
+        response = dns.message.make_response(request)
+
+        if reply is not None:
+            if hasattr(reply, 'rrset'):
+                response.answer.append(reply.rrset)
+            elif isinstance(reply, list):
+                response.answer.extend(reply)
+            else:
+                response.answer.append(reply)
+        else:
+            response.set_rcode(dns.rcode.NXRRSET)
+
+        return response.to_wire()
+
+    def cached_response(self, data, request=None):
+        # Fast path for plain queries (opcode QUERY, one question, nothing in the other
+        # sections) whose answer is in the zone: only the header and question are built
+        # per query, the answer section is copied from a previous rendering. Works on the
+        # raw packet, `request` is only needed to render answers the wire codec can't.
+        end = plain_query_end(data)
+        if end is None:
+            return None
+
+        key = data[12:end - 4].lower() + data[end - 4:end]
+        entry = self.answer_cache.get(key)
+        if entry is None and request is None:
+            entry = self.encode_response(data, key, end, self.answer_generation)
+            if entry is None:
+                return None
+        elif entry is None:
+            generation = self.answer_generation
+            rdtype = request.question[0].rdtype
+            if rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+                return None
+            # qname passed so a name covered by a wildcard isn't taken for NXDOMAIN
+            status, answer = self.index.lookup(key[:-4], rdtype, request.question[0].name)
+            if status == ANSWER:
+                response = dns.message.make_response(request)
+                response.answer.extend(answer)
+            elif status == NODATA or status == NXDOMAIN:
+                response = self.negative_answer(status).to_response(request)
+            else:
+                return None
+
+            wire = response.to_wire()
+            # Compression pointers in the sections refer to the question name at offset 12, which
+            # has the same length and label layout in every query for this key
+            entry = (wire[2] & 0xFE, wire[3], wire[4:12], wire[end:])
+            self.store_answer(generation, key, entry)
+
+        flags, rcode, counts, sections = entry
+        # QR (and AA for negative answers) from the rendering, RD copied from the query
+        return data[:2] + bytes((flags | (data[2] & 0x01), rcode)) + counts + data[12:end] + sections
+
+    def encode_response(self, data, key, end, generation):
+        # Answer cache entry for an A/AAAA/NS query with an answer in the zone, rendered by
+        # the wire codec instead of dnspython; None when dnspython has to do it
+        rdtype = int.from_bytes(key[-4:-2], "big")
+        if rdtype not in FAST_TYPES:
+            return None
+        # Without the qname a wildcard match comes back as NXDOMAIN, which is left to dnspython too
+        status, answer = self.index.lookup(key[:-4], rdtype)
+        if status != ANSWER:
+            return None
+        encoded = encode_answer(data[12:end - 4], answer)
+        if encoded is None:
+            return None
+
+        count, section = encoded
+        entry = (0x80, 0, b"\x00\x01" + count.to_bytes(2, "big") + b"\x00\x00\x00\x00", section)
+        self.store_answer(generation, key, entry)
+        return entry
+
+    def store_answer(self, generation, key, entry):
+        # `generation` is the one read before the zone lookup: if the zone changed since, the
+        # clear may already have happened and the entry would outlive it
+        with self.answer_lock:
+            if generation == self.answer_generation:
+                self.answer_cache[key] = entry
+
+    def clear_answers(self):
+        # Once a change is committed and indexed
+        with self.answer_lock:
+            self.answer_generation += 1
+            self.answer_cache.clear()
+
+    def resolve(self, request, data=None):
+        query_type = request.question[0].rdtype
 
         if hasattr(request, 'update') and len(request.update):
             return self.add_record(request)
-        elif query_type == "AXFR" or query_type == "IXFR":
+        elif query_type == dns.rdatatype.AXFR or query_type == dns.rdatatype.IXFR:
             # Handle zone transfer request
             return self.handle_axfr_request(request)
         else:
             # Handle other query types based on the loaded zone
-            return self.handle_standard_query(query_name, query_type)
+            return self.handle_standard_query(request, data)
 
-    def handle_standard_query(self, query_name, query_type):
+    def handle_standard_query(self, request, data=None):
         # Handle other query types based on the loaded zone
-        print(query_name, query_type)
-        try:
-            return self.zone.find_rrset(
-                dns.name.from_text(query_name), dns.rdatatype.from_text(query_type)
-            )
-        except KeyError:
-            print("Forwarding request to 1.1.1.1")
-            # Forward unknown requests to the specified DNS server
-            return self.forward_query(query_name, query_type)
+        question = request.question[0]
+        log.debug("query", "{} {}", question.name, dns.rdatatype.to_text(question.rdtype))
+
+        status, answer = self.index.lookup(self.question_key(question, data), question.rdtype, question.name)
+        if status == ANSWER or status == WILDCARD:
+            return answer
+        if status == NODATA or status == NXDOMAIN:
+            return self.negative_answer(status)
+
+        # Forward unknown requests to the specified DNS server, unless the answer is cached
+        if data is None:
+            data = request.to_wire()
+        return self.forward_cache.resolve((question.name, question.rdtype, question.rdclass), data)
+
+    def question_key(self, question, data=None):
+        # Lowercase wire form of the question name, straight from the packet when there is one
+        if data is not None:
+            end = question_end(data)
+            if end is not None:
+                return data[12:end - 4].lower()
+        return wire_key(question.name)
+
+    def forwarded(self, request, data=None):
+        # True if answering `request` means asking the forwarder, i.e. it may take a while
+        if hasattr(request, 'update') and len(request.update) or not request.question:
+            return False
+        question = request.question[0]
+        if question.rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            return False
+        return self.index.lookup(self.question_key(question, data), question.rdtype)[0] == OUT_OF_ZONE
+
+    def negative_answer(self, status):
+        # Authoritative NXDOMAIN/NODATA for a name in the zone, with the zone's SOA
+        rcode = dns.rcode.NXDOMAIN if status == NXDOMAIN else dns.rcode.NOERROR
+        return NegativeAnswer(rcode, self.index.soa(), authoritative=True)
 
     def handle_zone_transfer(self, zone_name, host, port):
-        # Create a DNS query for a zone transfer (AXFR or IXFR)
-
-        # Perform the query
-        axfr_request = dns.query.xfr(host, zone_name, rdtype=dns.rdatatype.IXFR, port=port,
-                                     use_udp=True, relativize=False)
-
-        zone = dns.zone.from_xfr(axfr_request, relativize=False)
+        # Ask for the changes since our serial; until a full transfer has given us the
+        # primary's key there is nothing to validate a diff against, so start from serial 0
+        with self.update_lock:
+            serial = 0
+            soa_rdataset = self.zone.get_rdataset(self.zone.origin, dns.rdatatype.SOA)
+            if self.primary_key is not None and soa_rdataset is not None:
+                serial = soa_rdataset[0].serial
+
+            # Perform the query over TCP; records are consumed as each message arrives
+            messages = dns.query.xfr(host, zone_name, rdtype=dns.rdatatype.IXFR, port=port,
+                                     relativize=False, serial=serial)
+            rrsets = (rrset for message in messages for rrset in message.answer)
+
+            current_soa = next(rrsets)
+            first = next(rrsets, None)
+            if first is None:
+                log.info("zone_transfer", "Zone is up to date")
+                return
+            if first.rdtype == dns.rdatatype.SOA:
+                self.apply_ixfr(current_soa, itertools.chain([first], rrsets))
+            else:
+                self.apply_axfr(itertools.chain([current_soa, first], rrsets))
+
+            log.info("zone_transfer", "Zone transfer successful. Zone saved to {}", self.zone_file_path)
+
+    def apply_axfr(self, rrsets):
+        zone = None
+        for rrset in rrsets:
+            if zone is None:
+                zone = Zone(rrset.name, relativize=False)
+            zrds = zone.find_rdataset(rrset.name, rrset.rdtype, rrset.covers, create=True)
+            zrds.update_ttl(rrset.ttl)
+            for rd in rrset:
+                zrds.add(rd)
 
+        self.primary_key = self.find_dnskey(zone)
         self.zone = self.validate_zone(zone)
-
-        # Save the zone to a file
-        with open(self.zone_file_path, 'w') as zone_file:
-            self.zone.to_file(zone_file, relativize=False, want_origin=True)
-
-        print(f"Zone transfer successful. Zone saved to {self.zone_file_path}")
-
-    def validate_zone(self, zone):
-        dns_key = None
-
-        # find public key
-        for name, node in zone.nodes.items():
-            for rdataset in node.rdatasets:
-                if rdataset.rdtype == dns.rdatatype.DNSKEY:
-                    dns_key = rdataset
+        self.index = ZoneIndex(self.zone)
+        self.clear_answers()
+        # A full transfer replaces everything, so write a new snapshot rather than a journal entry
+        self.zone_journal.compact(self.zone)
+
+    def apply_ixfr(self, current_soa, rrsets):
+        origin = self.zone.origin
+        serial = current_soa[0].serial
+
+        # Replay the deletions and additions on an overlay of the rdatasets they touch
+        update = ZoneUpdate(self.zone)
+        signatures = {}  # {(name, covered rdtype): RRSIG rrset}
+        delete_mode = None
+        for rrset in rrsets:
+            if rrset.rdtype == dns.rdatatype.SOA and rrset.name == origin:
+                if delete_mode is False and rrset[0].serial == serial:
+                    # The current SOA again, after the last addition set: the end
                     break
+                # Each other SOA starts a deletion set or an addition set
+                delete_mode = not delete_mode
+                if not delete_mode:
+                    update.replace(rrset)
+            elif rrset.rdtype == dns.rdatatype.RRSIG:
+                signatures[(rrset.name, rrset[0].type_covered)] = rrset
+            elif delete_mode:
+                update.delete(rrset)
+            else:
+                update.add(rrset)
+
+        # Only the rrsets the diff changed need to be validated, the rest of the zone already was
+        for rrset in update.rrsets():
+            sig_rrset = signatures.get((rrset.name, rrset.rdtype))
+            if sig_rrset is None:
+                raise ValidationFailure(f"no signature for {rrset.name} {dns.rdatatype.to_text(rrset.rdtype)}")
+            dns.dnssec.validate(rrset, sig_rrset, {origin: self.primary_key}, origin)
+
+        if update.get(origin, dns.rdatatype.SOA) != current_soa.to_rdataset():
+            raise ValidationFailure("IXFR does not end at the primary's serial")
+
+        deleted, added = update.diff()
+        self.zone_journal.record(self.zone.get_rrset(origin, dns.rdatatype.SOA), current_soa, deleted, added).wait()
+
+        names = update.names()
+        with self.zone_lock:
+            update.commit()
+        for name in names:
+            self.index.update(self.zone, name)
+        self.clear_answers()
+        if self.zone_journal.needs_compaction():
+            self.zone_journal.compact(self.zone)
+
+    def find_dnskey(self, zone):
+        return zone.get_rdataset(zone.origin, dns.rdatatype.DNSKEY)
 
+    def validate_zone(self, zone):
+        dns_key = self.find_dnskey(zone)
         if not dns_key:
             raise ValidationFailure
 
         origin = zone.origin
-        rrsets = []
-        for name, node in zone.nodes.items():
-            for rdataset in node.rdatasets:
-                rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
-                rrset.update(rdataset)
-                rrsets.append(rrset)
-
-        validated_rrsets = []
-        for i in range(0, len(rrsets), 2):
-            dns.dnssec.validate(rrsets[i], rrsets[i + 1], {origin: dns_key}, origin)
+        pairs = pair_signatures(zone)
+        self.validator.validate(pairs, origin, dns_key)
 
-            if not rrsets[i].rdtype == dns.rdatatype.DNSKEY:
-                validated_rrsets.append(rrsets[i])
+        validated_rrsets = [rrset for rrset, _ in pairs if rrset.rdtype != dns.rdatatype.DNSKEY]
 
         z = Zone(origin, relativize=False)
         for rrset in validated_rrsets:
@@ -115,76 +353,207 @@ class MyDNSHandler:
         return z
 
     def handle_axfr_request(self, request):
+        # A transfer over UDP has to fit in one datagram; otherwise answer the way RFC 1995
+        # asks, with a lone SOA for IXFR and TC for AXFR, so the client retries over TCP
         try:
-            # Create a response
-            response = dns.message.make_response(request)
-
-            soa_rrset = None
-            # Add other records to the answer section
-            for name, node in self.zone.nodes.items():
-                for rdataset in node.rdatasets:
-                    rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
-                    rrset.update(rdataset)
-                    sig_rrset = dns.rrset.RRset(name, dns.rdataclass.RdataClass.IN, dns.rdatatype.RdataType.RRSIG)
-                    sig_rrset.add(dns.dnssec.sign(rrset, self.private_key, self.zone.origin,
-                                                  self.public_key, expiration=2017974464, origin=self.zone.origin))
-
-                    if rrset.rdtype == dns.rdatatype.SOA:
-                        soa_rrset = rrset
-                    response.answer.append(rrset)
-                    response.answer.append(sig_rrset)
+            max_size = max(request.payload, 512) if request.edns >= 0 else 512
+            messages = self.transfer_messages(request, max_size)
+            wire = next(messages)
+            if next(messages, None) is None:
+                return wire
 
-            response.answer.append(soa_rrset)
-
-            print(response)
-
-            return response
+            response = dns.message.make_response(request)
+            response.flags |= dns.flags.AA
+            if request.question[0].rdtype == dns.rdatatype.IXFR:
+                response.answer.append(self.zone.get_rrset(self.zone.origin, dns.rdatatype.SOA))
+            else:
+                response.flags |= dns.flags.TC
+            return response.to_wire()
 
         except Exception as e:
-            print(f"Error handling AXFR request: {e}")
+            log.warning("zone_transfer", "Error handling AXFR request: {}", e)
+
+    def transfer_messages(self, request, max_size=65535):
+        # Renders the transfer one message at a time, each at most max_size bytes and with
+        # its own compression table, so only one message is ever held in memory
+        flags = dns.flags.QR | dns.flags.AA | (request.flags & dns.flags.RD)
+        question = request.question[0]
+
+        renderer = None
+        for rrset in self.transfer_rrsets(request):
+            if renderer is None:
+                renderer = dns.renderer.Renderer(request.id, flags, max_size)
+                renderer.add_question(question.name, question.rdtype, question.rdclass)
+            try:
+                renderer.add_rrset(dns.renderer.ANSWER, rrset)
+            except dns.exception.TooBig:
+                renderer.write_header()
+                yield renderer.get_wire()
+                renderer = dns.renderer.Renderer(request.id, flags, max_size)
+                renderer.add_question(question.name, question.rdtype, question.rdclass)
+                renderer.add_rrset(dns.renderer.ANSWER, rrset)
+
+        renderer.write_header()
+        yield renderer.get_wire()
+
+    def transfer_rrsets(self, request):
+        # The zone is captured when the transfer starts (node lists only; rdatasets are
+        # replaced on change, never modified) so later updates don't tear it
+        with self.zone_lock:
+            origin = self.zone.origin
+            soa_rrset = self.zone.get_rrset(origin, dns.rdatatype.SOA)
+
+            serial = None
+            if request.question[0].rdtype == dns.rdatatype.IXFR and len(request.authority):
+                serial = request.authority[0][0].serial
+
+            changes = None
+            if serial is not None and serial != soa_rrset[0].serial:
+                changes = self.journal.since(serial)
+
+            if changes:
+                # Final state of every rrset the changes touched, to sign for the secondary
+                touched = {(origin, dns.rdatatype.SOA)}
+                for change in changes:
+                    for rrset in change.deleted + change.added:
+                        touched.add((rrset.name, rrset.rdtype))
+                current = [self.zone.get_rrset(name, rdtype) for name, rdtype in touched]
+            elif serial != soa_rrset[0].serial:
+                nodes = [(name, tuple(node.rdatasets)) for name, node in self.zone.nodes.items()]
+
+        if serial == soa_rrset[0].serial:
+            # Requester is up to date, a lone SOA says so
+            yield soa_rrset
+        elif changes:
+            yield from self.ixfr_rrsets(soa_rrset, changes, current)
+        else:
+            # No journal covering the requester's serial, send the whole zone
+            yield from self.axfr_rrsets(soa_rrset, nodes)
+
+    def axfr_rrsets(self, soa_rrset, nodes):
+        yield soa_rrset
+        yield self.sign_rrset(soa_rrset)
+        for name, rdatasets in nodes:
+            for rdataset in rdatasets:
+                if rdataset.rdtype == dns.rdatatype.SOA:
+                    continue
+                rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
+                rrset.update(rdataset)
+                yield rrset
+                yield self.sign_rrset(rrset)
+        yield soa_rrset
+
+    def ixfr_rrsets(self, soa_rrset, changes, current):
+        # RFC 1995 layout: current SOA, then per change the old SOA and the deleted
+        # records followed by the new SOA and the added records, then the current SOA again
+        yield soa_rrset
+        for change in changes:
+            yield change.old_soa
+            yield from change.deleted
+            yield change.new_soa
+            yield from change.added
+
+        # Signatures over the final state of the touched rrsets, sent as additions so the
+        # secondary can validate what it ends up with
+        for rrset in current:
+            if rrset is not None:
+                yield self.sign_rrset(rrset)
+        yield soa_rrset
+
+    def sign_rrset(self, rrset):
+        return self.signatures.get(rrset)
 
     def add_record(self, request):
-        try:
-            # Add the new record to the zone
-            zone_checkpoint = copy.deepcopy(self.zone)
-            node = self.zone.nodes.get(request.update[0].name)
-            if not node:
-                node = self.zone.node_factory()
-                self.zone.nodes[request.update[0].name] = node
-            zrds = node.find_rdataset(request.update[0].rdclass, request.update[0].rdtype, request.update[0].covers,
-                                      True)
-            for rd in request.update[0]:
-                zrds.add(rd)
-
-            self.zone.check_origin()
-
-            znode = self.zone.nodes.get(self.zone.origin)
-            zrds = znode.find_rdataset(dns.rdataclass.IN, dns.rdatatype.DNSKEY)
-
-            zrds.discard(self.public_key)
-
+        # Updates and transfers bump the serial of the SOA they read, so they run one at a time.
+        # The journal write is waited for after update_lock is released, so the updates that
+        # queue up meanwhile reach the disk with the same fsync.
+        with self.update_lock:
             try:
-                self.zone = self.validate_zone(self.zone)
+                # Stage the changes in an overlay, the zone is untouched until commit
+                update = ZoneUpdate(self.zone)
+                for rrset in request.update:
+                    # Deletions are flagged by the class the record was sent with (RFC 2136 section 2.5)
+                    if rrset.deleting == dns.rdataclass.ANY:
+                        if rrset.rdtype == dns.rdatatype.ANY:
+                            update.delete_name(rrset.name)
+                        else:
+                            update.delete_rrset(rrset.name, rrset.rdtype)
+                    elif rrset.deleting == dns.rdataclass.NONE:
+                        update.delete(rrset)
+                    else:
+                        update.add(rrset)
+                old_soa, new_soa = update.bump_serial()
+
+                try:
+                    self.validate_update(update)
+                except Exception as e:
+                    log.warning("update", "Skipping update: {}", e)
+                    return None
+
+                # Queued before the change is visible, so the journal has the changes in serial order
+                deleted, added = update.diff()
+                written = self.zone_journal.record(old_soa, new_soa, deleted, added)
+
+                names = update.names()
+                with self.zone_lock:
+                    update.commit()
+
+                self.journal.record(old_soa, new_soa, deleted, added)
+                for name in names:
+                    self.index.update(self.zone, name)
+                self.clear_answers()
+                if self.zone_journal.needs_compaction():
+                    self.zone_journal.compact(self.zone)
+
             except Exception as e:
-                print(f"Skipping update: {e}")
-                self.zone = zone_checkpoint
+                log.error("update", "Error adding A record: {}", e)
                 return None
 
-            # Save the modified zone back to the file
-            with open(self.zone_file_path, 'w') as zone_file:
-                self.zone.to_file(zone_file, relativize=False, want_origin=True)
+        # Only acknowledged once it's on disk
+        try:
+            written.wait()
+        except Exception as e:
+            # The change is already served, so put the whole zone on disk instead of the journal block
+            log.error("update", "Journal write failed, writing a zone snapshot instead: {}", e)
+            with self.update_lock:
+                self.zone_journal.compact(self.zone)
+            return None
 
-            print("Add record finished")
+        log.info("update", "Add record finished")
 
-            return request.update[0]
+        return request.update[0]
 
-        except Exception as e:
-            print(f"Error adding A record: {e}")
+    def validate_update(self, update):
+        # Only the rrsets this update touched, the rest of the zone hasn't changed
+        origin = self.zone.origin
+        dns_key = self.find_dnskey(self.zone)
+        if not dns_key:
+            raise ValidationFailure
 
-    def forward_query(self, query_name, query_type):
-        resolver = dns.resolver.Resolver()
-        resolver.nameservers = [self.forwarding_server]
-        return resolver.resolve(query_name, dns.rdatatype.from_text(query_type))
+        for name in update.names():
+            if not name.is_subdomain(origin):
+                raise ValidationFailure(f"{name} is outside {origin}")
+            rdtypes = update.rdtypes(name)
+            if dns.rdatatype.CNAME in rdtypes and rdtypes - {dns.rdatatype.CNAME, dns.rdatatype.RRSIG}:
+                raise ValidationFailure(f"{name} has a CNAME and other data")
+
+        # Signing here also leaves the new signatures cached for the next transfer
+        for rrset in update.rrsets():
+            dns.dnssec.validate(rrset, self.signatures.sign(rrset), {origin: dns_key}, origin)
+
+    def forward_query(self, request, data=None):
+        if data is None:
+            data = request.to_wire()
+
+        log.debug("forward", "Forwarding request to {}", self.forwarding_server)
+        reply = dns.message.from_wire(self.forwarder.query(data))
+        negative = NegativeAnswer.from_reply(reply)
+        if negative is not None:
+            return negative
+        if not len(reply.answer):
+            return None
+        # The whole answer section, a CNAME chain ends in the rrset that was asked for
+        return list(reply.answer)
     
     def run(self):
         raise NotImplementedError
\ No newline at end of file
@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+OTHER = "other sources"  # count key for everything past max_keys
+
+
+class EventLog:
+    """Structured log written by a background thread.
+
+    Callers only append a record to a bounded buffer and never wait for the output:
+    when the buffer is full the record is dropped and counted, so a slow stdout pipe
+    slows down the log instead of the server. Messages are str.format templates,
+    filled in by the writer thread, so records below `level` cost next to nothing.
+
+    Every event type gets at most `burst` records per `interval` seconds, the rest
+    are counted and reported once per interval. `count` is for events that happen
+    per packet (blocked queries and the like): nothing is written per call, one
+    summary per key is written every interval instead.
+    """
+
+    def __init__(self, level=INFO, buffer_size=10000, interval=1.0, burst=10, max_keys=1000, json_format=False,
+                 stream=None):
+        self.level = level
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self.json_format = json_format
+        self.stream = stream
+
+        self.buffer = deque()  # (time, level, event, message, args, fields), oldest first
+        self.lock = threading.Lock()
+        self.emitted = {}  # {event: records this interval}
+        self.suppressed = {}  # {(level, event): records over the burst this interval}
+        self.counters = {}  # {(level, event, message, format_key): {key: count}} for this interval
+        self.dropped = 0
+
+        self.writer = None
+        self.stop = threading.Event()
+        # A forked worker has the buffer but not the writer thread, it starts its own
+        os.register_at_fork(after_in_child=self.reset)
+
+    def log(self, level, event, message, *args, **fields):
+        if level < self.level:
+            return
+        with self.lock:
+            emitted = self.emitted.get(event, 0)
+            if emitted >= self.burst:
+                self.suppressed[(level, event)] = self.suppressed.get((level, event), 0) + 1
+                return
+            self.emitted[event] = emitted + 1
+        self.append((time.time(), level, event, message, args, fields))
+
+    def debug(self, event, message, *args, **fields):
+        if DEBUG >= self.level:  # called per query, skip the second call when it's off
+            self.log(DEBUG, event, message, *args, **fields)
+
+    def info(self, event, message, *args, **fields):
+        self.log(INFO, event, message, *args, **fields)
+
+    def warning(self, event, message, *args, **fields):
+        self.log(WARNING, event, message, *args, **fields)
+
+    def error(self, event, message, *args, **fields):
+        self.log(ERROR, event, message, *args, **fields)
+
+    def count(self, level, event, key, message, format_key=None):
+        # Counts one occurrence for `key`; `message` is the summary written at the end of the
+        # interval, a template for {count}, {key} and {interval}. Keys past max_keys are lumped
+        # together. `format_key` turns the key into text when the summary is written.
+        if level < self.level:
+            return
+        with self.lock:
+            counter = self.counters.get((level, event, message, format_key))
+            if counter is None:
+                counter = self.counters[(level, event, message, format_key)] = {}
+            if key not in counter and len(counter) >= self.max_keys:
+                key = OTHER
+            counter[key] = counter.get(key, 0) + 1
+        if self.writer is None:
+            self.start()
+
+    def append(self, record):
+        if len(self.buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        self.buffer.append(record)
+        if self.writer is None:
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.writer is not None:
+                return
+            self.writer = threading.Thread(target=self.run, daemon=True)
+            self.writer.start()
+        atexit.register(self.close)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.writer = None
+        self.stop = threading.Event()
+
+    def close(self):
+        # Writes out what is still buffered
+        self.stop.set()
+        if self.writer is not None and self.writer is not threading.current_thread():
+            self.writer.join()
+
+    def run(self):
+        next_summary = time.monotonic() + self.interval
+        while not self.stop.wait(0.1):
+            if time.monotonic() >= next_summary:
+                self.summarize()
+                next_summary += self.interval
+            self.flush()
+        self.summarize()
+        self.flush()
+
+    def summarize(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            suppressed, self.suppressed = self.suppressed, {}
+            self.emitted = {}
+            dropped, self.dropped = self.dropped, 0
+
+        now = time.time()
+        for (level, event, message, format_key), counter in counters.items():
+            for key, count in counter.items():
+                if format_key is not None and key != OTHER:
+                    key = format_key(key)
+                self.buffer.append((now, level, event, message, (), {"key": key, "count": count,
+                                                                     "interval": self.interval}))
+        for (level, event), count in suppressed.items():
+            self.buffer.append((now, level, event, "{count:,} more {event} messages suppressed in last {interval:g}s",
+                                (), {"event": event, "count": count, "interval": self.interval}))
+        if dropped:
+            self.buffer.append((now, WARNING, "log", "Dropped {count:,} log records in last {interval:g}s, buffer full",
+                                (), {"count": dropped, "interval": self.interval}))
+
+    def flush(self):
+        lines = []
+        while self.buffer:
+            lines.append(self.format(*self.buffer.popleft()))
+        if not lines:
+            return
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            pass  # nowhere left to report it
+
+    def format(self, stamp, level, event, message, args, fields):
+        try:
+            text = message.format(*args, **fields)
+        except (IndexError, KeyError, ValueError):
+            text = " ".join([message] + [str(arg) for arg in args])
+
+        if self.json_format:
+            fields = {name: value for name, value in fields.items() if name != "event"}
+            return json.dumps({"time": round(stamp, 3), "level": LEVEL_NAMES.get(level, level), "event": event,
+                               "message": text, **fields}, default=str)
+        when = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(stamp))
+        return f"{when}.{int(stamp % 1 * 1000):03d} {LEVEL_NAMES.get(level, level)} {event}: {text}"
+
+
+# Shared by every module of the process
+log = EventLog()
+
+
+def add_arguments(parser):
+    parser.add_argument("--log_level", choices=list(LEVELS), default="info", help="Least severe level logged")
+    parser.add_argument("--log_format", choices=['text', 'json'], default='text', help="Log lines as text or JSON")
+
+
+def configure(args):
+    log.level = LEVELS[args.log_level]
+    log.json_format = args.log_format == 'json'
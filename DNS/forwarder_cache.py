@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.rrset
+
+from DNS.response_cache import NegativeAnswer, answer_ttl
+
+
+class Entry:
+    __slots__ = ("answer", "ttl", "expire_time", "stale_until", "wire", "hits", "refresh", "retry_after")
+
+    def __init__(self, answer, ttl, now, max_stale, wire):
+        self.answer = answer
+        self.ttl = ttl
+        self.expire_time = now + ttl
+        self.stale_until = self.expire_time + max_stale
+        self.wire = wire  # query to send when the entry is refreshed
+        self.hits = 0
+        self.refresh = None  # future of the refresh in flight
+        self.retry_after = 0
+
+
+class ForwarderCache:
+    """Cache of forwarded answers (answer sections and NegativeAnswers) for names outside the zone.
+
+    Answers are served with their remaining TTL. An entry asked for at least
+    `prefetch_hits` times is refreshed in the background once less than
+    `prefetch_ratio` of its TTL is left, so popular names never miss.
+
+    Expired entries are kept for another `max_stale` seconds and served stale
+    (RFC 8767) with a TTL of `stale_ttl` straight away, while a refresh runs in the
+    background; only a name that was never cached waits for the forwarder. After a
+    failed refresh the forwarder is left alone for `stale_ttl` seconds.
+    """
+
+    def __init__(self, fetch, max_entries=10000, max_ttl=86400, prefetch_ratio=0.1, prefetch_hits=2,
+                 stale_ttl=30, max_stale=86400, refresh_threads=2):
+        self.fetch = fetch  # fetch(query wire) -> [rrset, ...], NegativeAnswer or None, raises if the forwarder failed
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.prefetch_ratio = prefetch_ratio
+        self.prefetch_hits = prefetch_hits
+        self.stale_ttl = stale_ttl
+        self.max_stale = max_stale
+
+        self.entries = OrderedDict()  # {(qname, qtype, rdclass): Entry}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(refresh_threads)
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.stale = 0
+
+    def resolve(self, key, wire, now=None):
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now >= entry.stale_until:
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                entry.hits += 1
+                if now < entry.expire_time:
+                    self.hits += 1
+                    if entry.refresh is None and entry.hits >= self.prefetch_hits and \
+                            entry.expire_time - now <= entry.ttl * self.prefetch_ratio:
+                        self.prefetches += 1
+                        entry.refresh = self.executor.submit(self.refresh, key, entry.wire)
+                    return self.with_ttl(entry.answer, entry.expire_time - now, now - (entry.expire_time - entry.ttl))
+
+                # Expired: answer stale now, the refresh replaces the entry once it's back
+                if entry.refresh is None and now >= entry.retry_after:
+                    entry.refresh = self.executor.submit(self.refresh, key, wire)
+                self.stale += 1
+                return self.with_ttl(entry.answer, self.stale_ttl)
+
+        answer = self.fetch(wire)
+        self.put(key, wire, answer)
+        return answer
+
+    def refresh(self, key, wire):
+        try:
+            answer = self.fetch(wire)
+        except Exception:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.refresh = None
+                    entry.retry_after = time.time() + self.stale_ttl
+            raise
+
+        self.put(key, wire, answer)
+        return answer
+
+    def put(self, key, wire, answer, now=None):
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            ttl = min(answer_ttl(answer), self.max_ttl) if answer is not None else 0
+            if ttl <= 0 or self.max_entries <= 0:
+                # Nothing worth caching, keep serving what we had
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.refresh = None
+                return
+
+            self.entries[key] = Entry(answer, ttl, now, self.max_stale, wire)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def with_ttl(self, answer, ttl, elapsed=0):
+        # A copy of the cached answer with its TTLs counted down by `elapsed` seconds and
+        # capped at `ttl`, each rrset of an answer section on its own
+        if isinstance(answer, list):
+            return [self.with_ttl(rrset, ttl, elapsed) for rrset in answer]
+        if isinstance(answer, NegativeAnswer):
+            if answer.soa is None:
+                return answer
+            return NegativeAnswer(answer.rcode, self.with_ttl(answer.soa, ttl, elapsed))
+        ttl = max(min(answer.ttl - int(elapsed), int(ttl)), 0)
+        return dns.rrset.from_rdata_list(answer.name, ttl, list(answer))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "prefetches": self.prefetches, "stale": self.stale}
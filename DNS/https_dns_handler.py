@@ -1,42 +1,209 @@
 # DNS/https_dns_handler.py
 
-import socket
-import ssl
-import re
+import asyncio
+import base64
+import binascii
+from urllib.parse import urlsplit, parse_qs
+
+from DNS.event_log import log
 from DNS.ssl_dns_handler import MySSLDNSHandler
+from DNS.wire_codec import min_ttl
 import dns.message
+import dns.rcode
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+DNS_MESSAGE = "application/dns-message"
+MAX_BODY = 65535
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           415: "Unsupported Media Type", 431: "Request Header Fields Too Large", 501: "Not Implemented"}
+
 
 class MyHTTPSDNSHandler(MySSLDNSHandler):
-    def __init__(self, forwarding_server="1.1.1.1", zone_file_path="./zones/primary.zone", private_key_path=None, listen_address="0.0.0.0", port=443):
-        super().__init__(forwarding_server, zone_file_path, private_key_path)
-        self.listen_address = listen_address
-        self.port = port
+    """DNS over HTTPS (RFC 8484) at /dns-query, with GET and POST.
+
+    HTTP/1.1 connections are kept alive and serve requests one after the other. When
+    the h2 package is installed and the client negotiates it through ALPN, HTTP/2 is
+    used instead and each stream is answered independently. Responses carry a
+    Cache-Control max-age equal to the smallest TTL in them.
+    """
+
+    def __init__(self, forwarding_server="1.1.1.1", zone_file_path="./zones/primary.zone", private_key_path=None, listen_address="0.0.0.0", port=443, validation_workers=None,
+                 certfile="ssl_certs/server.crt", keyfile="ssl_certs/server.key", max_connections=1000,
+                 idle_timeout=10, max_pipelined=64, query_threads=16):
+        super().__init__(forwarding_server, zone_file_path, private_key_path, listen_address, port, validation_workers,
+                         certfile, keyfile, max_connections, idle_timeout, max_pipelined, query_threads)
+
+    def make_ssl_context(self):
+        context = super().make_ssl_context()
+        context.set_alpn_protocols(["h2", "http/1.1"] if h2 is not None else ["http/1.1"])
+        return context
+
+    async def serve(self):
+        self.ssl_context = self.make_ssl_context()
+        server = await asyncio.start_server(self.handle_connection, self.listen_address, self.port, backlog=128)
+
+        log.info("listen", "HTTPS DNS Server (DoH) listening on {}:{}", self.listen_address, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_connection(self, reader, writer):
+        ssl_object = writer.get_extra_info("ssl_object")
+        if h2 is not None and ssl_object is not None and ssl_object.selected_alpn_protocol() == "h2":
+            await self.serve_http2(reader, writer)
+        else:
+            await self.serve_http1(reader, writer)
+
+    async def serve_http1(self, reader, writer):
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+            except asyncio.LimitOverrunError:
+                await self.send_http1(writer, 431, [], b"", False)
+                return
+            except asyncio.TimeoutError:
+                return
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                await self.send_http1(writer, 400, [], b"", False)
+                return
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
 
-    def run(self):
-        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        context.load_cert_chain(certfile="ssl_certs/server.crt", keyfile="ssl_certs/server.key")
+            if "transfer-encoding" in headers:
+                await self.send_http1(writer, 501, [], b"", False)
+                return
+            length = headers.get("content-length", "") or "0"
+            if not (length.isascii() and length.isdigit()):
+                await self.send_http1(writer, 400, [], b"", False)
+                return
+            # Compared as text first so an absurdly long number isn't converted at all
+            if len(length.lstrip("0")) > len(str(MAX_BODY)) or int(length) > MAX_BODY:
+                await self.send_http1(writer, 413, [], b"", False)
+                return
+            length = int(length)
+            body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout) if length else b""
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind((self.listen_address, self.port))
-        sock.listen(5)
-        
-        print(f"HTTPS DNS Server (DoH) listening on {self.listen_address}:{self.port}")
+            status, response_headers, payload = await self.handle_http(method, target, headers, body)
+            await self.send_http1(writer, status, response_headers, payload, keep_alive)
+            if not keep_alive:
+                return
 
+    async def send_http1(self, writer, status, headers, body, keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}"]
+        lines += [f"{key}: {value}" for key, value in headers]
+        if not keep_alive:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve_http2(self, reader, writer):
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        streams = {}  # {stream id: (headers, body)} for requests still being received
+        pending = set()
         try:
             while True:
-                client_socket, addr = sock.accept()
-                with context.wrap_socket(client_socket, server_side=True) as https_socket:
-                    headers = https_socket.recv(1024).decode('utf-8')
-                    content_length = int(re.search(r'Content-Length: (\d+)', headers).group(1))
-                    data = https_socket.recv(content_length)
-                    
-                    request = dns.message.from_wire(data)
-                    response_data = self.handle_request(request)
-                    
-                    if response_data:
-                        response_headers = f"HTTP/1.1 200 OK\r\nContent-Type: application/dns-message\r\nContent-Length: {len(response_data)}\r\n\r\n"
-                        https_socket.send(response_headers.encode('utf-8') + response_data)
-        except KeyboardInterrupt:
-            print("Shutting down HTTPS DNS server...")
+                try:
+                    data = await asyncio.wait_for(reader.read(65535), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if pending:
+                        continue
+                    return
+                if not data:
+                    return
+
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        streams[event.stream_id] = (dict(event.headers), bytearray())
+                    elif isinstance(event, h2.events.DataReceived):
+                        stream = streams.get(event.stream_id)
+                        if stream is not None:
+                            stream[1].extend(event.data)
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        headers, body = streams.pop(event.stream_id)
+                        task = asyncio.create_task(self.answer_http2(conn, writer, event.stream_id, headers, bytes(body)))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                    elif isinstance(event, h2.events.StreamReset):
+                        streams.pop(event.stream_id, None)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+
+                writer.write(conn.data_to_send())
+                await writer.drain()
         finally:
-            sock.close()
+            for task in list(pending):
+                task.cancel()
+
+    async def answer_http2(self, conn, writer, stream_id, headers, body):
+        status, response_headers, payload = await self.handle_http(headers.get(":method"), headers.get(":path", ""),
+                                                                   headers, body)
+        try:
+            conn.send_headers(stream_id, [(":status", str(status)), ("content-length", str(len(payload)))] + response_headers)
+            conn.send_data(stream_id, payload, end_stream=True)
+        except h2.exceptions.H2Error as e:
+            log.warning("query_error", "Error answering DoH stream: {}", e)
+            return
+        writer.write(conn.data_to_send())
+        await writer.drain()
+
+    async def handle_http(self, method, target, headers, body):
+        # (status, [(header, value), ...], body) for one DoH request
+        url = urlsplit(target)
+        if url.path != "/dns-query":
+            return 404, [], b""
+
+        if method == "GET":
+            param = parse_qs(url.query).get("dns")
+            if not param:
+                return 400, [], b""
+            try:
+                data = base64.urlsafe_b64decode(param[0] + "=" * (-len(param[0]) % 4))
+            except (binascii.Error, ValueError):
+                return 400, [], b""
+        elif method == "POST":
+            if headers.get("content-type") != DNS_MESSAGE:
+                return 415, [], b""
+            data = body
+        else:
+            return 405, [("Allow", "GET, POST")], b""
+
+        try:
+            request = dns.message.from_wire(data)
+        except Exception:
+            return 400, [], b""
+
+        response_data = await self.answer_wire(request, data)
+        if response_data is None:
+            response = dns.message.make_response(request)
+            response.set_rcode(dns.rcode.SERVFAIL)
+            response_data = response.to_wire()
+
+        return 200, [("Content-Type", DNS_MESSAGE), ("Cache-Control", f"max-age={self.max_age(response_data)}")], \
+            response_data
+
+    def max_age(self, response_data):
+        # RFC 8484 section 5.1: no longer than the smallest TTL in the response, and for a
+        # negative answer no longer than its SOA minimum. Read from the wire, responses from
+        # the answer cache are never parsed otherwise
+        return min_ttl(response_data)
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import deque
+
+HIGH = 0  # verified clients and names we already have an answer for
+NORMAL = 1
+LOW = 2  # sources close to their rate limit
+
+
+class IngressQueue:
+    """Bounded priority queue between the receive loop and the resolve workers.
+
+    Packets are taken highest priority first, oldest first within a priority. When
+    the queue is full a new packet pushes out the newest packet of the lowest
+    priority below its own, or is shed itself if there is none. Packets that waited
+    longer than `deadline` seconds are dropped when they come up, since the client
+    has most likely given up on them already.
+    """
+
+    def __init__(self, max_size=1000, deadline=1.5):
+        self.max_size = max_size
+        self.deadline = deadline
+
+        self.queues = (deque(), deque(), deque())  # per priority: (arrival time, data, addr)
+        self.size = 0
+        self.cond = threading.Condition()
+
+        self.admitted = 0
+        self.shed = [0, 0, 0]  # per priority of the packet shed
+        self.expired = 0
+
+    def put(self, priority, data, addr, now=None):
+        # False if the packet was shed
+        if now is None:
+            now = time.monotonic()
+
+        with self.cond:
+            if self.size >= self.max_size:
+                for victim in range(LOW, priority, -1):
+                    if self.queues[victim]:
+                        self.queues[victim].pop()
+                        self.shed[victim] += 1
+                        break
+                else:
+                    self.shed[priority] += 1
+                    return False
+            else:
+                self.size += 1
+
+            self.queues[priority].append((now, data, addr))
+            self.admitted += 1
+            self.cond.notify()
+            return True
+
+    def get(self):
+        # (data, addr) of the next packet still worth answering, waits for one
+        with self.cond:
+            while True:
+                while not self.size:
+                    self.cond.wait()
+
+                queue = next(queue for queue in self.queues if queue)
+                arrived, data, addr = queue.popleft()
+                self.size -= 1
+                if time.monotonic() - arrived <= self.deadline:
+                    return data, addr
+                self.expired += 1
+
+    def stats(self):
+        return {"depth": self.size, "depth_by_priority": [len(queue) for queue in self.queues],
+                "admitted": self.admitted, "shed": sum(self.shed), "shed_by_priority": list(self.shed),
+                "expired": self.expired}
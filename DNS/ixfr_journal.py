@@ -0,0 +1,37 @@
+from collections import deque
+
+
+class Change:
+    __slots__ = ("old_soa", "new_soa", "deleted", "added")
+
+    def __init__(self, old_soa, new_soa, deleted, added):
+        self.old_soa = old_soa
+        self.new_soa = new_soa
+        self.deleted = deleted  # [rrset, ...], SOA not included
+        self.added = added  # [rrset, ...], SOA not included
+
+
+class IXFRJournal:
+    """In-memory list of zone diffs, one per SOA serial, used to answer IXFR.
+
+    Only the last `max_changes` diffs are kept; a requester whose serial is older
+    than that has to get a full AXFR.
+    """
+
+    def __init__(self, max_changes=1000):
+        self.changes = deque(maxlen=max_changes)
+
+    def record(self, old_soa, new_soa, deleted, added):
+        self.changes.append(Change(old_soa, new_soa, deleted, added))
+
+    def since(self, serial):
+        # Diffs taking `serial` to the current serial, [] if already current, None if not covered
+        if not self.changes:
+            return None
+        if self.changes[-1].new_soa[0].serial == serial:
+            return []
+
+        for i, change in enumerate(self.changes):
+            if change.old_soa[0].serial == serial:
+                return list(self.changes)[i:]
+        return None
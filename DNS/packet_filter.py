@@ -0,0 +1,54 @@
+import dns.opcode
+
+from DNS.wire_codec import question_end
+
+OK = 0
+MALFORMED = 1
+RESPONSE = 2  # QR set, somebody is reflecting responses at us
+QDCOUNT = 3
+OVERSIZED = 4
+OPCODE = 5
+
+REASONS = ("ok", "malformed", "response", "qdcount", "oversized", "opcode")
+
+MIN_SIZE = 12 + 1 + 4  # header, root name, qtype and qclass
+
+
+class PacketFilter:
+    """Checks a raw packet before dnspython ever sees it.
+
+    Only fixed header offsets are read, plus a walk over the labels of the question
+    name, so junk, responses, packets with other than one question, oversized
+    packets and opcodes we don't serve are dropped without building any objects.
+    Works on the receive buffer directly: pass the buffer and the number of bytes
+    received, with the buffer one byte larger than `max_size` so that oversized
+    packets show up as such instead of being cut short.
+    """
+
+    def __init__(self, opcodes=(dns.opcode.QUERY, dns.opcode.UPDATE), max_size=4096):
+        self.max_size = max_size
+        # Verdict for every value of the third header byte (QR, opcode, AA, TC, RD)
+        self.flags_verdict = bytes(RESPONSE if flags & 0x80 else OK if (flags >> 3) & 0x0F in opcodes else OPCODE
+                                   for flags in range(256))
+        self.dropped = [0] * len(REASONS)
+
+    def check(self, buf, length):
+        # OK, or the reason the packet should be dropped
+        if length > self.max_size:
+            verdict = OVERSIZED
+        elif length < MIN_SIZE:
+            verdict = MALFORMED
+        else:
+            verdict = self.flags_verdict[buf[2]]
+            if verdict == OK:
+                if buf[4] or buf[5] != 1:
+                    verdict = QDCOUNT
+                elif question_end(buf, length) is None:
+                    verdict = MALFORMED
+
+        if verdict != OK:
+            self.dropped[verdict] += 1
+        return verdict
+
+    def stats(self):
+        return {reason: count for reason, count in zip(REASONS[1:], self.dropped[1:])}
@@ -0,0 +1,187 @@
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+
+
+def parse_address(ip):
+    # (address width in bits, address as int), cheaper than going through ipaddress
+    if ":" in ip:
+        return 128, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    return 32, int.from_bytes(socket.inet_aton(ip), "big")
+
+
+def format_prefix(bits, prefix, length):
+    version_cls = ipaddress.IPv4Network if bits == 32 else ipaddress.IPv6Network
+    return str(version_cls((prefix << (bits - length), length)))
+
+
+def format_match(match):
+    # Text of a (bits, prefix, length) ban as returned by lookup, which leaves formatting
+    # to whoever prints it since it runs for every blocked packet
+    return format_prefix(*match)
+
+
+class PrefixNode:
+    __slots__ = ("prefix", "length", "until", "children")
+
+    def __init__(self, prefix, length, until=0.0):
+        self.prefix = prefix  # the top `length` bits of the network, right aligned
+        self.length = length
+        self.until = until  # unban time, 0 if this node only exists for branching
+        self.children = [None, None]
+
+
+class PrefixBanTree:
+    """Path-compressed binary radix (Patricia) tree of banned prefixes.
+
+    lookup() walks at most `bits` levels whatever the number of bans, and answers
+    "is this address or any prefix enclosing it banned" in a single pass.
+    Expired bans are cleared lazily when a lookup walks past them.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = PrefixNode(0, 0)
+        self.count = 0
+
+    def insert(self, prefix, length, until):
+        node = self.root
+        while True:
+            if node.length == length:
+                if not node.until:
+                    self.count += 1
+                node.until = max(node.until, until)
+                return
+
+            bit = (prefix >> (length - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = PrefixNode(prefix, length, until)
+                self.count += 1
+                return
+
+            common = self.common_length(prefix, length, child.prefix, child.length)
+            if common == child.length:
+                node = child
+                continue
+
+            # The new prefix and child diverge (or the new prefix encloses child): split
+            if common == length:
+                parent = PrefixNode(prefix, length, until)
+                self.count += 1
+            else:
+                parent = PrefixNode(prefix >> (length - common), common)
+                parent.children[(prefix >> (length - common - 1)) & 1] = PrefixNode(prefix, length, until)
+                self.count += 1
+            parent.children[(child.prefix >> (child.length - common - 1)) & 1] = child
+            node.children[bit] = parent
+            return
+
+    def lookup(self, address, now):
+        node = self.root
+        bits = self.bits
+        while node is not None:
+            if node.length and (address >> (bits - node.length)) != node.prefix:
+                return None
+            if node.until:
+                if now < node.until:
+                    return node
+                node.until = 0.0
+                self.count -= 1
+            if node.length == bits:
+                return None
+            node = node.children[(address >> (bits - node.length - 1)) & 1]
+        return None
+
+    def common_length(self, prefix_a, length_a, prefix_b, length_b):
+        length = min(length_a, length_b)
+        diff = (prefix_a >> (length_a - length)) ^ (prefix_b >> (length_b - length))
+        return length - diff.bit_length()
+
+    def prune(self, now):
+        # Rebuild from the bans still in force, dropping dead branches
+        live = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.until > now:
+                live.append((node.prefix, node.length, node.until))
+            stack.extend(child for child in node.children if child is not None)
+
+        self.root = PrefixNode(0, 0)
+        self.count = 0
+        for prefix, length, until in live:
+            self.insert(prefix, length, until)
+
+    def __len__(self):
+        return self.count
+
+
+class BanList:
+    """Per-address and per-prefix bans for both address families.
+
+    Bans on single addresses are escalated to their enclosing prefix (/24 and /48 by
+    default) once `escalate_after` addresses from that prefix have been banned within
+    one ban period.
+    """
+
+    def __init__(self, ban_duration, prefix_v4=24, prefix_v6=48, escalate_after=4, max_entries=100000):
+        self.ban_duration = ban_duration
+        self.escalate_after = escalate_after
+        self.max_entries = max_entries
+
+        self.trees = {32: PrefixBanTree(32), 128: PrefixBanTree(128)}
+        self.prefix_lengths = {32: prefix_v4, 128: prefix_v6}
+        self.offenders = OrderedDict()  # {(bits, prefix): [banned_addresses, window_start]}
+
+    def lookup(self, bits, address, now=None):
+        if now is None:
+            now = time.monotonic()
+        # (bits, prefix, length) of the ban that covers the address, None if there is none
+        node = self.trees[bits].lookup(address, now)
+        if node is None:
+            return None
+        return bits, node.prefix, node.length
+
+    def prefix_of(self, bits, address):
+        length = self.prefix_lengths[bits]
+        return length, address >> (bits - length)
+
+    def ban_prefix(self, bits, prefix, length, now=None):
+        if now is None:
+            now = time.monotonic()
+        tree = self.trees[bits]
+        if len(tree) >= self.max_entries:
+            tree.prune(now)
+        tree.insert(prefix, length, now + self.ban_duration)
+        return format_prefix(bits, prefix, length)
+
+    def ban(self, bits, address, now=None):
+        # Returns the enclosing prefix if this ban escalated to it
+        if now is None:
+            now = time.monotonic()
+
+        tree = self.trees[bits]
+        if len(tree) >= self.max_entries:
+            tree.prune(now)
+        if len(tree) < self.max_entries:
+            tree.insert(address, bits, now + self.ban_duration)
+
+        length, prefix = self.prefix_of(bits, address)
+        if length >= bits or not self.escalate_after:
+            return None
+
+        key = (bits, prefix)
+        offenders = self.offenders.get(key)
+        if offenders is None or now - offenders[1] >= self.ban_duration:
+            offenders = self.offenders[key] = [0, now]
+            if len(self.offenders) > self.max_entries:
+                self.offenders.popitem(last=False)
+        offenders[0] += 1
+
+        if offenders[0] < self.escalate_after:
+            return None
+
+        del self.offenders[key]
+        return self.ban_prefix(bits, prefix, length, now)
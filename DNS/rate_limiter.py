@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "stamp", "banned_until")
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.banned_until = 0.0
+
+
+class RateLimiter:
+    """Per-client token buckets with a hard cap on how many clients are tracked.
+
+    Each client may burst up to `burst` queries and then gets `rate` queries per second.
+    A client that runs out of tokens is banned for `ban_duration` seconds; bans expire
+    lazily the next time the client is seen. Once `max_clients` buckets exist the least
+    recently seen client is forgotten, so a spoofed-source flood can't grow memory.
+    """
+
+    ALLOWED = 0
+    BLOCKED = 1  # already banned
+    BANNED = 2  # banned by this query
+
+    def __init__(self, rate, burst, ban_duration, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.ban_duration = ban_duration
+        self.max_clients = max_clients
+
+        self.buckets = OrderedDict()  # {client: TokenBucket}, least recently seen first
+        self.evictions = 0
+
+    def check(self, client, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self.buckets.popitem(last=False)
+                self.evictions += 1
+            bucket = self.buckets[client] = TokenBucket(self.burst, now)
+        else:
+            self.buckets.move_to_end(client)
+
+        if bucket.banned_until:
+            if now < bucket.banned_until:
+                return self.BLOCKED
+            # Ban is over, start again with a full bucket
+            bucket.banned_until = 0.0
+            bucket.tokens = self.burst
+            bucket.stamp = now
+
+        tokens = bucket.tokens + (now - bucket.stamp) * self.rate
+        bucket.stamp = now
+        if tokens > self.burst:
+            tokens = self.burst
+
+        if tokens < 1:
+            bucket.tokens = tokens
+            bucket.banned_until = now + self.ban_duration
+            return self.BANNED
+
+        bucket.tokens = tokens - 1
+        return self.ALLOWED
+
+    def ban(self, client, duration=None, now=None):
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.burst, now)
+        bucket.banned_until = now + (self.ban_duration if duration is None else duration)
+
+    def headroom(self, client):
+        # Fraction of the burst the client has left as of its last query
+        bucket = self.buckets.get(client)
+        return 1.0 if bucket is None else bucket.tokens / self.burst
+
+    def is_banned(self, client, now=None):
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get(client)
+        return bucket is not None and now < bucket.banned_until
+
+    def __len__(self):
+        return len(self.buckets)
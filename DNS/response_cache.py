@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class NegativeAnswer:
+    """An NXDOMAIN or NODATA answer (RFC 2308).
+
+    Keeps the rcode and the zone's SOA, which goes in the authority section of the
+    response with its TTL lowered to the SOA minimum. That TTL is also how long the
+    answer can be cached, so a NegativeAnswer can be put in a ResponseCache as is.
+    Without an SOA the TTL is 0 and the answer is never cached.
+    """
+
+    __slots__ = ("rcode", "soa", "ttl", "authoritative")
+
+    def __init__(self, rcode, soa=None, authoritative=False):
+        self.rcode = rcode
+        self.authoritative = authoritative
+        self.soa = None
+        self.ttl = 0
+        if soa is not None:
+            self.ttl = min(soa.ttl, soa[0].minimum)
+            self.soa = dns.rrset.from_rdata_list(soa.name, self.ttl, list(soa))
+
+    @classmethod
+    def from_reply(cls, reply):
+        # None if the upstream reply has an answer
+        if reply.rcode() != dns.rcode.NXDOMAIN and (reply.rcode() != dns.rcode.NOERROR or len(reply.answer)):
+            return None
+        soa = next((rrset for rrset in reply.authority if rrset.rdtype == dns.rdatatype.SOA), None)
+        return cls(reply.rcode(), soa)
+
+    def to_response(self, request):
+        response = dns.message.make_response(request)
+        response.set_rcode(self.rcode)
+        if self.authoritative:
+            response.flags |= dns.flags.AA
+        if self.soa is not None:
+            response.authority.append(self.soa)
+        return response
+
+
+def answer_ttl(answer):
+    # TTL of an answer section (list of rrsets, e.g. a CNAME chain), rrset or NegativeAnswer
+    if isinstance(answer, list):
+        return min(rrset.ttl for rrset in answer) if answer else 0
+    return answer.ttl
+
+
+def counted_down(answer, elapsed):
+    # A copy of a cached answer with its TTLs lowered by the seconds it has been cached
+    if isinstance(answer, list):
+        return [counted_down(rrset, elapsed) for rrset in answer]
+    if isinstance(answer, NegativeAnswer):
+        if answer.soa is None:
+            return answer
+        return NegativeAnswer(answer.rcode, counted_down(answer.soa, elapsed), answer.authoritative)
+    return dns.rrset.from_rdata_list(answer.name, max(answer.ttl - int(elapsed), 0), list(answer))
+
+
+class ResponseCache:
+    """Bounded LRU cache of upstream answers keyed by (qname, qtype, rdclass).
+
+    Entries live for the lowest TTL of the cached answer section (or of the
+    NegativeAnswer), clamped to [min_ttl, max_ttl]. Answers come back with their
+    TTLs counted down by the time they spent in the cache.
+    A TTL of 0 (after clamping) means the answer is never cached.
+    """
+
+    def __init__(self, max_entries=10000, min_ttl=0, max_ttl=86400):
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+
+        self.entries = OrderedDict()  # {(qname, qtype, rdclass): (expire_time, stored_time, answer)}
+        self.keys_by_name = {}  # {qname: {(qname, qtype, rdclass), ...}}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, now=None):
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expire_time, stored_time, answer = entry
+            if now >= expire_time:
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return counted_down(answer, now - stored_time)
+
+    def __contains__(self, key):
+        # Fresh entry for key, without touching the LRU order or the hit counts
+        entry = self.entries.get(key)
+        return entry is not None and time.time() < entry[0]
+
+    def put(self, key, answer, now=None):
+        ttl = min(max(answer_ttl(answer), self.min_ttl), self.max_ttl)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = (now + ttl, now, answer)
+            self.keys_by_name.setdefault(key[0], set()).add(key)
+
+            # Evict least recently used entries once we go over the size limit
+            while len(self.entries) > self.max_entries:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, qname):
+        with self.lock:
+            for key in list(self.keys_by_name.get(qname, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_name.clear()
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        keys = self.keys_by_name.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_name[key[0]]
@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict
+
+import dns.rcode
+
+from DNS.response_cache import NegativeAnswer
+from DNS.wire_codec import question_end
+
+SEND = 0
+DROP = 1
+SLIP = 2  # send a truncated response instead
+
+# Response types, each accounted separately
+ANSWER = 0
+NODATA = 1
+NXDOMAIN = 2
+ERROR = 3
+BLOCKED = 4  # the query itself was rejected, nothing is ever sent in full
+
+
+class Account:
+    __slots__ = ("balance", "stamp", "dropped")
+
+    def __init__(self, balance, stamp):
+        self.balance = balance
+        self.stamp = stamp
+        self.dropped = 0
+
+
+def response_type(qname, reply):
+    # (response type, name it is accounted under) for an answer (rrsets), NegativeAnswer or None (failure)
+    if reply is None:
+        return ERROR, None
+    if isinstance(reply, NegativeAnswer):
+        if reply.rcode == dns.rcode.NXDOMAIN:
+            # Under the zone rather than the name, so random subdomains share one account
+            return NXDOMAIN, reply.soa.name if reply.soa is not None else qname
+        return NODATA, qname
+    return ANSWER, qname
+
+
+def truncated_response(data):
+    # Smallest valid reply to the query in `data`: header with QR and TC set and the
+    # question copied, None if the query is too broken to answer
+    if len(data) < 12 or data[2] & 0x80 or data[4:6] != b"\x00\x01":
+        return None
+    end = question_end(data)
+    if end is None:
+        return None
+    flags = 0x80 | (data[2] & 0x79) | 0x02  # QR, opcode and RD from the query, TC
+    return data[:2] + bytes((flags, 0)) + b"\x00\x01\x00\x00\x00\x00\x00\x00" + data[12:end]
+
+
+class ResponseRateLimiter:
+    """BIND-style Response Rate Limiting.
+
+    Responses are accounted per (client prefix, qname, response type). Every account
+    earns `rate` credits per second, up to one second's worth, and each response
+    spends one. Responses over the limit are dropped, except that every `slip`-th
+    one is sent as a truncated (TC=1) reply: a real client retries over TCP, which
+    can't be spoofed, while a spoofed flood reflects almost nothing. Debt is capped
+    at `window` seconds of credits, so an account recovers at most `window` seconds
+    after the flood stops. `slip=0` drops everything over the limit.
+
+    Queries from blocked sources have their own account per prefix, which only ever
+    buys truncated replies.
+    """
+
+    def __init__(self, rate=5, window=15, slip=2, max_entries=100000):
+        self.rate = rate
+        self.window = window
+        self.slip = slip
+        self.max_entries = max_entries
+
+        self.accounts = OrderedDict()  # {(prefix, name, response type): Account}, least recently used first
+        self.sent = 0
+        self.dropped = 0
+        self.slipped = 0
+
+    def check(self, prefix, name, rtype, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        account = self.account((prefix, name, rtype), now)
+        if self.spend(account, now):
+            self.sent += 1
+            return SEND
+
+        account.dropped += 1
+        if self.slip and account.dropped % self.slip == 0:
+            self.slipped += 1
+            return SLIP
+        self.dropped += 1
+        return DROP
+
+    def blocked(self, prefix, now=None):
+        # Verdict for a query that was rejected before it got a response: the prefix's
+        # credit buys truncated replies only, at most `rate` a second
+        if now is None:
+            now = time.monotonic()
+
+        if self.spend(self.account((prefix, None, BLOCKED), now), now):
+            self.slipped += 1
+            return SLIP
+        self.dropped += 1
+        return DROP
+
+    def spend(self, account, now):
+        # Takes one credit, False if the account is over its limit
+        balance = account.balance + (now - account.stamp) * self.rate
+        account.stamp = now
+        if balance > self.rate:
+            balance = self.rate
+
+        balance -= 1
+        if balance >= 0:
+            account.balance = balance
+            return True
+        account.balance = max(balance, -self.window * self.rate)
+        return False
+
+    def account(self, key, now):
+        account = self.accounts.get(key)
+        if account is None:
+            if len(self.accounts) >= self.max_entries:
+                self.accounts.popitem(last=False)
+            account = self.accounts[key] = Account(self.rate, now)
+        else:
+            self.accounts.move_to_end(key)
+        return account
+
+    def stats(self):
+        return {"accounts": len(self.accounts), "sent": self.sent, "dropped": self.dropped, "slipped": self.slipped}
@@ -0,0 +1,184 @@
+import struct
+import time
+from multiprocessing import shared_memory
+
+from DNS.prefix_tree import format_prefix
+from DNS.rate_limiter import RateLimiter
+
+# kind, address bits, prefix length, address (16 bytes), then three float fields whose
+# meaning depends on the kind: (tokens, stamp, banned_until) or (offenders, window_start, banned_until)
+SLOT = struct.Struct("<BBB5x16sddd")
+FIELDS = struct.Struct("<ddd")
+FIELDS_OFFSET = SLOT.size - FIELDS.size
+
+EMPTY = 0
+BUCKET = 1
+BAN = 2
+
+MAX_PROBE = 8
+
+
+class SharedTable:
+    """Fixed-size open-addressing hash table in shared memory.
+
+    Created once by the parent process and inherited by forked workers, so a ban or a
+    counter update made by one worker is seen by all the others on their next lookup.
+    There is no cross-process lock: two workers racing on the same slot can lose an
+    update, which only makes a counter slightly off. When every slot in a probe window
+    is taken, the entry seen longest ago that isn't banned is overwritten.
+    """
+
+    def __init__(self, slots=262144):
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * SLOT.size)
+        self.buf = self.shm.buf
+
+    def find(self, kind, bits, length, address, defaults=None, now=0.0):
+        # Returns (slot offset, fields) or None; creates the entry with `defaults` if given
+        key = address.to_bytes(16, "big")
+        start = hash((kind, length, address)) % self.slots
+
+        victim = None
+        victim_stamp = float("inf")
+        for i in range(MAX_PROBE):
+            offset = ((start + i) % self.slots) * SLOT.size
+            slot_kind, slot_bits, slot_length, slot_key, a, b, until = SLOT.unpack_from(self.buf, offset)
+            if slot_kind == EMPTY:
+                victim = offset
+                break
+            if slot_kind == kind and slot_bits == bits and slot_length == length and slot_key == key:
+                return offset, [a, b, until]
+            if until <= now and b < victim_stamp:
+                victim, victim_stamp = offset, b
+
+        if defaults is None or victim is None:
+            return None
+
+        SLOT.pack_into(self.buf, victim, kind, bits, length, key, *defaults)
+        return victim, list(defaults)
+
+    def store(self, offset, fields):
+        FIELDS.pack_into(self.buf, offset + FIELDS_OFFSET, *fields)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedRateLimiter:
+    """RateLimiter with its token buckets kept in a SharedTable.
+
+    Keys are (bits, address) pairs. With `prefix_lengths` set, keys are (bits, prefix)
+    pairs and the buckets are per prefix instead of per address.
+    """
+
+    def __init__(self, table, rate, burst, ban_duration, prefix_lengths=None):
+        self.table = table
+        self.rate = rate
+        self.burst = burst
+        self.ban_duration = ban_duration
+        self.prefix_lengths = prefix_lengths
+
+    def check(self, client, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        bits, address = client
+        length = bits if self.prefix_lengths is None else self.prefix_lengths[bits]
+        entry = self.table.find(BUCKET, bits, length, address, (self.burst, now, 0.0), now)
+        if entry is None:
+            # Nowhere to keep state for this client, let it through rather than block it
+            return RateLimiter.ALLOWED
+        offset, (tokens, stamp, banned_until) = entry
+
+        if banned_until:
+            if now < banned_until:
+                return RateLimiter.BLOCKED
+            banned_until = 0.0
+            tokens = self.burst
+            stamp = now
+
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        if tokens < 1:
+            self.table.store(offset, (tokens, now, now + self.ban_duration))
+            return RateLimiter.BANNED
+
+        self.table.store(offset, (tokens - 1, now, banned_until))
+        return RateLimiter.ALLOWED
+
+    def headroom(self, client):
+        bits, address = client
+        length = bits if self.prefix_lengths is None else self.prefix_lengths[bits]
+        entry = self.table.find(BUCKET, bits, length, address)
+        return 1.0 if entry is None else entry[1][0] / self.burst
+
+
+class SharedBanList:
+    """BanList for --workers mode, with bans kept in a SharedTable.
+
+    Only bans on single addresses and on the configured prefix length are supported,
+    so a lookup is two probes instead of a tree walk.
+    """
+
+    def __init__(self, table, ban_duration, prefix_v4=24, prefix_v6=48, escalate_after=4):
+        self.table = table
+        self.ban_duration = ban_duration
+        self.escalate_after = escalate_after
+        self.prefix_lengths = {32: prefix_v4, 128: prefix_v6}
+
+    def lookup(self, bits, address, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        entry = self.table.find(BAN, bits, bits, address)
+        if entry is not None and now < entry[1][2]:
+            return bits, address, bits
+
+        length, prefix = self.prefix_of(bits, address)
+        entry = self.table.find(BAN, bits, length, prefix)
+        if entry is not None and now < entry[1][2]:
+            return bits, prefix, length
+
+        return None
+
+    def prefix_of(self, bits, address):
+        length = self.prefix_lengths[bits]
+        return length, address >> (bits - length)
+
+    def ban_prefix(self, bits, prefix, length, now=None):
+        if now is None:
+            now = time.monotonic()
+        entry = self.table.find(BAN, bits, length, prefix, (0.0, now, 0.0), now)
+        if entry is not None:
+            offset, fields = entry
+            fields[2] = now + self.ban_duration
+            self.table.store(offset, fields)
+        return format_prefix(bits, prefix, length)
+
+    def ban(self, bits, address, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        self.ban_prefix(bits, address, bits, now)
+
+        length, prefix = self.prefix_of(bits, address)
+        if length >= bits or not self.escalate_after:
+            return None
+
+        entry = self.table.find(BAN, bits, length, prefix, (0.0, now, 0.0), now)
+        if entry is None:
+            return None
+        offset, (offenders, window_start, banned_until) = entry
+        if now - window_start >= self.ban_duration:
+            offenders, window_start = 0.0, now
+        offenders += 1
+
+        if offenders < self.escalate_after:
+            self.table.store(offset, (offenders, window_start, banned_until))
+            return None
+
+        self.table.store(offset, (0.0, now, now + self.ban_duration))
+        return format_prefix(bits, prefix, length)
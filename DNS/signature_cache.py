@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+
+import dns.dnssec
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+from DNS.event_log import log
+
+# Inception is backdated so a secondary whose clock runs a little behind still accepts new signatures
+CLOCK_SKEW = 3600
+
+
+class SignatureCache:
+    """RRSIGs for a zone's rrsets, kept between transfers.
+
+    Signatures are keyed by a digest of the rrset's canonical form, so an unchanged rrset
+    is never signed twice and a changed one misses automatically. Only the latest
+    signature per (name, rdtype) is kept. A background thread re-signs entries that are
+    within `refresh_before` seconds of expiring, so transfers never wait on RSA for them.
+    """
+
+    def __init__(self, private_key, public_key, origin, validity=30 * 86400, refresh_before=7 * 86400,
+                 refresh_interval=3600):
+        self.private_key = private_key
+        self.public_key = public_key
+        self.origin = origin
+        self.validity = validity
+        self.refresh_before = refresh_before
+        self.refresh_interval = refresh_interval
+
+        self.entries = {}  # {digest: (sig rrset, expiration, rrset)}
+        self.digests = {}  # {(name, rdtype): digest} latest signed version of each rrset
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.signed = 0
+
+        self.refresher = None
+
+    def digest(self, rrset):
+        # Owner, type, class and TTL, then the rdatas in canonical order, as RFC 4034 section 6 signs them
+        h = hashlib.sha256()
+        h.update(rrset.name.canonicalize().to_wire())
+        h.update(rrset.rdtype.to_bytes(2, "big") + rrset.rdclass.to_bytes(2, "big") + rrset.ttl.to_bytes(4, "big"))
+        for rdata in sorted(rd.to_digestable(self.origin) for rd in rrset):
+            h.update(len(rdata).to_bytes(2, "big"))
+            h.update(rdata)
+        return h.digest()
+
+    def get(self, rrset):
+        digest = self.digest(rrset)
+        entry = self.entries.get(digest)
+        if entry is not None and entry[1] - time.time() > self.refresh_before:
+            self.hits += 1
+            return entry[0]
+        return self.sign(rrset, digest)
+
+    def sign(self, rrset, digest=None):
+        if digest is None:
+            digest = self.digest(rrset)
+
+        now = time.time()
+        expiration = int(now) + self.validity
+        sig_rrset = dns.rrset.RRset(rrset.name, dns.rdataclass.RdataClass.IN, dns.rdatatype.RdataType.RRSIG)
+        sig_rrset.add(dns.dnssec.sign(rrset, self.private_key, self.origin, self.public_key,
+                                      inception=int(now) - CLOCK_SKEW, expiration=expiration,
+                                      origin=self.origin))
+
+        with self.lock:
+            key = (rrset.name, rrset.rdtype)
+            old = self.digests.get(key)
+            if old is not None and old != digest:
+                self.entries.pop(old, None)
+            self.digests[key] = digest
+            self.entries[digest] = (sig_rrset, expiration, rrset)
+            self.signed += 1
+        return sig_rrset
+
+    def refresh(self):
+        # Re-sign everything that would otherwise be re-signed on the transfer path soon
+        deadline = time.time() + self.refresh_before
+        with self.lock:
+            due = [(digest, rrset) for digest, (_, expiration, rrset) in self.entries.items()
+                   if expiration <= deadline]
+        for digest, rrset in due:
+            self.sign(rrset, digest)
+        return len(due)
+
+    def start_refresher(self):
+        if self.refresher is not None:
+            return
+        self.refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.refresher.start()
+
+    def refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                refreshed = self.refresh()
+                if refreshed:
+                    log.info("signatures", "Refreshed {} expiring signatures", refreshed)
+            except Exception as e:
+                log.error("signatures", "Error refreshing signatures: {}", e)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "signed": self.signed}
@@ -1,36 +1,147 @@
 # DNS/ssl_dns_handler.py
 
-import socket
+import asyncio
 import ssl
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
 from DNS.dns_handler import MyDNSHandler
+from DNS.event_log import log
 import dns.message
+import dns.rdatatype
+
 
 class MySSLDNSHandler(MyDNSHandler):
-    def __init__(self, forwarding_server="1.1.1.1", zone_file_path="./zones/primary.zone", private_key_path=None, listen_address="0.0.0.0", port=853):
-        super().__init__(forwarding_server, zone_file_path, private_key_path)
+    """DNS over TLS (RFC 7858) on persistent connections.
+
+    Each connection carries any number of length-prefixed queries (RFC 7766). Queries
+    are answered concurrently and each response is written as soon as it is ready, so
+    a slow forwarded query doesn't hold up the ones pipelined behind it. Connections
+    are closed after `idle_timeout` seconds with nothing in flight, and new ones are
+    refused before the TLS handshake once `max_connections` are open.
+    """
+
+    def __init__(self, forwarding_server="1.1.1.1", zone_file_path="./zones/primary.zone", private_key_path=None, listen_address="0.0.0.0", port=853, validation_workers=None,
+                 certfile="ssl_certs/server.crt", keyfile="ssl_certs/server.key", max_connections=1000,
+                 idle_timeout=10, max_pipelined=64, query_threads=16):
+        super().__init__(forwarding_server, zone_file_path, private_key_path, validation_workers)
         self.listen_address = listen_address
         self.port = port
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_pipelined = max_pipelined
 
-    def run(self):
+        # Queries that miss the answer cache may block on the forwarder, so they run in
+        # threads; updates and transfers share one thread so they are applied in order
+        self.query_executor = ThreadPoolExecutor(query_threads)
+        self.update_executor = ThreadPoolExecutor(1)
+        self.connections = 0
+
+    def make_ssl_context(self):
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        context.load_cert_chain(certfile="ssl_certs/server.crt", keyfile="ssl_certs/server.key")
-        
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind((self.listen_address, self.port))
-        sock.listen(5)
-        
-        print(f"TLS DNS Server (DoT) listening on {self.listen_address}:{self.port}")
+        context.load_cert_chain(certfile=self.certfile, keyfile=self.keyfile)
+        # Session tickets let returning clients resume without a full handshake
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = 2
+        return context
 
+    def run(self):
         try:
-            while True:
-                client_socket, addr = sock.accept()
-                with context.wrap_socket(client_socket, server_side=True) as tls_socket:
-                    data = tls_socket.recv(512)
-                    request = dns.message.from_wire(data)
-                    response_data = self.handle_request(request)
-                    if response_data:
-                        tls_socket.send(response_data)
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
-            print("Shutting down TLS DNS server...")
+            log.info("shutdown", "Shutting down TLS DNS server...")
+
+    async def serve(self):
+        self.ssl_context = self.make_ssl_context()
+        server = await asyncio.start_server(self.handle_connection, self.listen_address, self.port, backlog=128)
+
+        log.info("listen", "TLS DNS Server (DoT) listening on {}:{}", self.listen_address, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            # Refused before the handshake, so a flood of connections costs no TLS work
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            await writer.start_tls(self.ssl_context, ssl_handshake_timeout=self.idle_timeout)
+            await self.serve_connection(reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ssl.SSLError):
+            pass
         finally:
-            sock.close()
+            self.connections -= 1
+            writer.close()
+
+    async def serve_connection(self, reader, writer):
+        pending = set()
+        try:
+            while True:
+                try:
+                    length = await asyncio.wait_for(reader.readexactly(2), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if pending:
+                        continue
+                    break
+                data = await asyncio.wait_for(reader.readexactly(struct.unpack("!H", length)[0]),
+                                              self.idle_timeout)
+
+                if len(pending) >= self.max_pipelined:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                task = asyncio.create_task(self.answer(data, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            for task in list(pending):
+                task.cancel()
+
+    async def answer(self, data, writer):
+        try:
+            request = dns.message.from_wire(data)
+            if request.question and request.question[0].rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+                await self.stream_transfer(request, writer)
+                return
+        except Exception as e:
+            log.warning("query_error", "Error answering DoT query: {}", e)
+            return
+
+        response_data = await self.answer_wire(request, data)
+        if response_data:
+            await self.send(writer, response_data)
+
+    async def stream_transfer(self, request, writer):
+        loop = asyncio.get_running_loop()
+        messages = self.transfer_messages(request)
+        while True:
+            wire = await loop.run_in_executor(self.update_executor, next, messages, None)
+            if wire is None:
+                break
+            await self.send(writer, wire)
+
+    async def answer_wire(self, request, data):
+        # Response bytes for one query, None if there is nothing to send
+        try:
+            response_data = self.cached_response(data, request)
+            if response_data is None:
+                is_update = hasattr(request, 'update') and len(request.update)
+                executor = self.update_executor if is_update else self.query_executor
+                loop = asyncio.get_running_loop()
+                response_data = await loop.run_in_executor(executor, self.handle_request, request, data)
+            return response_data
+        except Exception as e:
+            log.warning("query_error", "Error answering query: {}", e)
+        return None
+
+    async def send(self, writer, wire):
+        try:
+            writer.write(struct.pack("!H", len(wire)) + wire)
+            await writer.drain()
+        except (ConnectionError, ssl.SSLError):
+            pass
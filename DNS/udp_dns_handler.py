@@ -1,69 +1,142 @@
 import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from DNS.dns_handler import MyDNSHandler
+from DNS.event_log import log
+from DNS.packet_filter import PacketFilter, OK
 import dns.message
+import dns.rdatatype
+
+# Control message from the gatekeeper or a test script: "ZONE_TRANSFER <zone> <host> <port>"
+ZONE_TRANSFER = b"ZONE_TRANSFER "
+
 
 class MyUDPDNSHandler(MyDNSHandler):
     def __init__(self, forwarding_server="1.1.1.1", zone_file_path="./zones/test_primary.zone",
-                 private_key_path="./keys/primary.pem", listen_address="", port=31111):
-        super().__init__(forwarding_server, zone_file_path, private_key_path)
+                 private_key_path="./keys/primary.pem", listen_address="", port=31111,
+                 validation_workers=None, forward_workers=8):
+        super().__init__(forwarding_server, zone_file_path, private_key_path, validation_workers)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind((listen_address, port))
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        self.packet_filter = PacketFilter()
         # self.socket.settimeout(5)
 
+        # Zone transfers (and anything else too big for a datagram) come in over TCP on the same port
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp_socket.bind((listen_address, port))
+        self.tcp_socket.listen(16)
+
+        # Queries for names outside the zone wait on the forwarder, so they are answered from
+        # here rather than the receive loop, which keeps answering the zone in the meantime
+        self.forward_pool = ThreadPoolExecutor(forward_workers)
+
     def run(self):
+        threading.Thread(target=self.run_tcp, daemon=True).start()
+        # Packets are received into one preallocated buffer and only copied out once the
+        # header checks have passed
+        buf = bytearray(self.packet_filter.max_size + 1)
+        view = memoryview(buf)
         try:
             while True:
                 try:
-                    data, addr = self.socket.recvfrom(4096)
+                    length, addr = self.socket.recvfrom_into(buf)
                 except ConnectionResetError as e:
-                    print(f"Connection reset by peer: {e}")
+                    log.debug("connection_reset", "Connection reset by peer: {}", e)
                     continue
 
-                message = ""
-                try:
-                    message = data.decode('utf-8')
-                except Exception:
-                    print("dns query received")
-
-                if message.split(' ')[0] == "ZONE_TRANSFER":
+                if length >= len(ZONE_TRANSFER) and view[:len(ZONE_TRANSFER)] == ZONE_TRANSFER:
+                    message = bytes(view[:length]).decode('utf-8', 'replace')
                     try:
                         self.handle_zone_transfer(message.split(' ')[1], message.split(' ')[2],
                                                   int(message.split(' ')[3]))
-                        print("Zone Transfer successful")
+                        log.info("zone_transfer", "Zone Transfer successful")
                         self.socket.sendto("SUCCESS".encode(), addr)
                     except Exception:
-                        print("Zone Transfer failed")
+                        log.warning("zone_transfer", "Zone Transfer failed")
                         self.socket.sendto("FAILURE".encode(), addr)
                     finally:
                         continue
 
-                # print(request)
-                try:
-                    request = dns.message.from_wire(data)
-                    reply = self.resolve(request)
-                except dns.resolver.NXDOMAIN:
-                    print("NOT FOUND")
+                if self.packet_filter.check(buf, length) != OK:
                     continue
 
-                if (dns.rdatatype.to_text(request.question[0].rdtype) == "AXFR" or
-                        dns.rdatatype.to_text(request.question[0].rdtype) == "IXFR"):
-                    self.socket.sendto(reply.to_wire(), addr)
+                data = bytes(view[:length])
+                try:
+                    # Plain queries answered from the zone don't need dnspython at all
+                    response_data = self.cached_response(data)
+                    if response_data is None:
+                        request = dns.message.from_wire(data)
+                        if self.forwarded(request, data):
+                            self.forward_pool.submit(self.answer_forwarded, request, data, addr)
+                            continue
+                        response_data = self.handle_request(request, data)
+                except Exception as e:
+                    log.warning("query_error", "Error answering query: {}", e)
                     continue
 
-                response = dns.message.make_response(request)
-
-                if reply is not None:
-                    if hasattr(reply, 'rrset'):
-                        response.answer.append(reply.rrset)
-                    else:
-                        response.answer.append(reply)
-                else:
-                    response.set_rcode(dns.rcode.NXRRSET)
-
-                self.socket.sendto(response.to_wire(), addr)
+                if response_data:
+                    self.socket.sendto(response_data, addr)
 
         except KeyboardInterrupt:
             pass
         finally:
-            self.socket.close()
\ No newline at end of file
+            self.socket.close()
+            self.tcp_socket.close()
+
+    def answer_forwarded(self, request, data, addr):
+        try:
+            response_data = self.handle_request(request, data)
+            if response_data:
+                self.socket.sendto(response_data, addr)
+        except Exception as e:
+            log.warning("query_error", "Error answering query: {}", e)
+
+    def run_tcp(self):
+        while True:
+            try:
+                conn, addr = self.tcp_socket.accept()
+            except OSError as e:
+                log.warning("tcp_error", "TCP accept failed: {}", e)
+                continue
+            threading.Thread(target=self.handle_tcp_connection, args=(conn, addr), daemon=True).start()
+
+    def handle_tcp_connection(self, conn, addr):
+        conn.settimeout(30)
+        try:
+            while True:
+                length = self.recv_exactly(conn, 2)
+                if length is None:
+                    break
+                data = self.recv_exactly(conn, struct.unpack("!H", length)[0])
+                if data is None:
+                    break
+
+                request = dns.message.from_wire(data)
+                if request.question and request.question[0].rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+                    # Stream the transfer message by message instead of building it whole
+                    count = 0
+                    for wire in self.transfer_messages(request):
+                        conn.sendall(struct.pack("!H", len(wire)) + wire)
+                        count += 1
+                    log.info("zone_transfer", "Sent {} messages to transfer {} to {}", count, self.zone.origin, addr[0])
+                    continue
+
+                response_data = self.handle_request(request, data)
+                if response_data:
+                    conn.sendall(struct.pack("!H", len(response_data)) + response_data)
+        except Exception as e:
+            log.warning("tcp_error", "TCP connection from {} failed: {}", addr[0], e)
+        finally:
+            conn.close()
+
+    def recv_exactly(self, conn, count):
+        data = b""
+        while len(data) < count:
+            chunk = conn.recv(count - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
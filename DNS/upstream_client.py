@@ -0,0 +1,125 @@
+import queue
+import secrets
+import socket
+import threading
+import time
+
+import dns.exception
+import dns.inet
+
+from DNS.wire_codec import same_question
+
+
+class UpstreamClient:
+    """Reusable client for one upstream nameserver.
+
+    Keeps a small pool of connected UDP sockets so that forwarding a query is just a
+    send/recv on an existing socket. Callers pass the query in wire format; it is sent
+    under a random message ID and the reply is handed back with the caller's ID restored.
+    Replies that don't match the ID and the question in flight (late answers to queries
+    that already timed out, or spoofed ones) are dropped. Truncated replies are retried over TCP.
+    """
+
+    def __init__(self, host, port=53, pool_size=4, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.family = dns.inet.af_for_address(host)
+
+        # Sockets are created on first use so that an unreachable forwarder doesn't fail startup
+        self.pool = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def query(self, wire, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+
+        sock = self.acquire()
+        broken = False
+        try:
+            reply = self.exchange_udp(sock, secrets.randbelow(65536).to_bytes(2, "big") + wire[2:], timeout)
+        except OSError:
+            broken = True
+            raise
+        finally:
+            self.release(sock, broken)
+
+        if reply[2] & 0x02:  # TC bit, answer didn't fit into a datagram
+            return self.query_tcp(wire, timeout)
+
+        return wire[:2] + reply[2:]
+
+    def query_tcp(self, wire, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+
+        with socket.create_connection((self.host, self.port), timeout=timeout) as sock:
+            sock.sendall(len(wire).to_bytes(2, "big") + wire)
+            length = int.from_bytes(self.recv_exactly(sock, 2), "big")
+            return self.recv_exactly(sock, length)
+
+    def exchange_udp(self, sock, wire, timeout):
+        expiration = time.monotonic() + timeout
+        sock.send(wire)
+        while True:
+            remaining = expiration - time.monotonic()
+            if remaining <= 0:
+                raise dns.exception.Timeout
+            sock.settimeout(remaining)
+            try:
+                reply = sock.recv(65535)
+            except socket.timeout:
+                raise dns.exception.Timeout
+            if len(reply) >= 12 and reply[:2] == wire[:2] and same_question(wire, reply):
+                return reply
+
+    def acquire(self):
+        while True:
+            try:
+                return self.pool.get(timeout=self.timeout if self.created >= self.pool_size else 0.0)
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                create = self.created < self.pool_size
+                if create:
+                    self.created += 1
+            if create:
+                break
+
+        try:
+            sock = socket.socket(self.family, socket.SOCK_DGRAM)
+            sock.connect((self.host, self.port))
+        except OSError:
+            with self.lock:
+                self.created -= 1
+            raise
+        return sock
+
+    def release(self, sock, broken=False):
+        if not broken:
+            self.pool.put(sock)
+            return
+
+        # Don't hand a broken socket back to the pool
+        sock.close()
+        with self.lock:
+            self.created -= 1
+
+    def recv_exactly(self, sock, count):
+        data = b""
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError("upstream closed the connection")
+            data += chunk
+        return data
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,144 @@
+import dns.ipv4
+import dns.ipv6
+import dns.rdatatype
+
+# Query types answered without dnspython when the answer is in the zone
+FAST_TYPES = frozenset((dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.NS))
+
+PLAIN_COUNTS = b"\x00\x01\x00\x00\x00\x00\x00\x00"  # one question, nothing else
+
+
+def question_end(data, length=None):
+    # Offset just past the first question in the first `length` bytes of `data`: a name of
+    # at most 255 bytes, uncompressed, then qtype and qclass. None if it is malformed.
+    if length is None:
+        length = len(data)
+    pos = 12
+    end = min(length, 12 + 255)
+    while pos < end:
+        label = data[pos]
+        if label == 0:
+            pos += 5
+            return pos if pos <= length else None
+        if label > 63:
+            return None
+        pos += label + 1
+    return None
+
+
+def same_question(query, reply):
+    # True if `reply` repeats the question of `query` byte for byte, name case included
+    end = question_end(query)
+    if end is None:
+        return False
+    return reply[4:6] == query[4:6] and reply[12:end] == query[12:end]
+
+
+def plain_query_end(data):
+    # End of the question of a plain query: opcode QUERY, one question of class IN and
+    # nothing in the other sections (so no EDNS). None for anything else, or if the
+    # question name is malformed or compressed
+    if len(data) < 17 or data[2] & 0xF8 or data[4:12] != PLAIN_COUNTS:
+        return None
+    end = question_end(data)
+    if end is None or data[end - 2:end] != b"\x00\x01":
+        return None
+    return end
+
+
+def encode_answer(qname, rrsets):
+    # (record count, answer section) for `rrsets`, rendered the way dnspython renders them
+    # behind a question for `qname` (wire format) at offset 12, with the same name
+    # compression. None if one of the rrsets isn't A, AAAA, NS or CNAME.
+    table = {}
+    key = qname.lower()
+    pos = 0
+    while qname[pos]:
+        table[key[pos:]] = 12 + pos
+        pos += qname[pos] + 1
+
+    base = 12 + len(qname) + 4  # the answer section starts after qtype and qclass
+    out = bytearray()
+    count = 0
+    for rrset in rrsets:
+        rdtype = rrset.rdtype
+        if rdtype not in (dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.NS, dns.rdatatype.CNAME):
+            return None
+
+        fixed = (rdtype.to_bytes(2, "big") + rrset.rdclass.to_bytes(2, "big") + rrset.ttl.to_bytes(4, "big"))
+        for rd in rrset:
+            write_name(out, base, table, rrset.name.to_wire())
+            out += fixed
+            if rdtype == dns.rdatatype.A:
+                out += b"\x00\x04" + dns.ipv4.inet_aton(rd.address)
+            elif rdtype == dns.rdatatype.AAAA:
+                out += b"\x00\x10" + dns.ipv6.inet_aton(rd.address)
+            else:
+                start = len(out) + 2
+                out += b"\x00\x00"
+                write_name(out, base, table, rd.target.to_wire())
+                out[start - 2:start] = (len(out) - start).to_bytes(2, "big")
+            count += 1
+
+    return count, bytes(out)
+
+
+def write_name(out, base, table, wire):
+    # Appends the name (uncompressed wire format) to `out`, pointing at the longest suffix
+    # already written. Suffixes are matched case-insensitively, as in dnspython.
+    key = wire.lower()
+    pos = 0
+    while wire[pos]:
+        pointer = table.get(key[pos:])
+        if pointer is not None:
+            out += (0xC000 | pointer).to_bytes(2, "big")
+            return
+        offset = base + len(out)
+        if offset <= 0x3FFF:
+            table[key[pos:]] = offset
+        end = pos + wire[pos] + 1
+        out += wire[pos:end]
+        pos = end
+    out += b"\x00"
+
+
+def skip_name(data, pos):
+    # Offset just past the (possibly compressed) name at `pos`, None if it runs off the end
+    while pos < len(data):
+        length = data[pos]
+        if length == 0:
+            return pos + 1
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        if length & 0xC0:
+            return None
+        pos += length + 1
+    return None
+
+
+def min_ttl(data):
+    # Smallest TTL in the answer and authority sections of a response, and the SOA minimum
+    # of a negative answer, read from the wire; 0 if there are no records or they are malformed
+    pos = 12
+    for _ in range(int.from_bytes(data[4:6], "big")):
+        pos = skip_name(data, pos)
+        if pos is None:
+            return 0
+        pos += 4
+
+    ttl = None
+    for _ in range(int.from_bytes(data[6:8], "big") + int.from_bytes(data[8:10], "big")):
+        pos = skip_name(data, pos)
+        if pos is None or pos + 10 > len(data):
+            return 0
+        rdtype = int.from_bytes(data[pos:pos + 2], "big")
+        record_ttl = int.from_bytes(data[pos + 4:pos + 8], "big")
+        end = pos + 10 + int.from_bytes(data[pos + 8:pos + 10], "big")
+        if end > len(data):
+            return 0
+        if rdtype == dns.rdatatype.SOA:
+            record_ttl = min(record_ttl, int.from_bytes(data[end - 4:end], "big"))
+        if ttl is None or record_ttl < ttl:
+            ttl = record_ttl
+        pos = end
+    return ttl or 0
@@ -0,0 +1,184 @@
+import dns.rdatatype
+import dns.rrset
+
+ANSWER = 0
+WILDCARD = 1  # answer synthesized from a wildcard
+NODATA = 2
+NXDOMAIN = 3
+OUT_OF_ZONE = 4
+
+MAX_CNAME_CHAIN = 8
+
+
+def wire_key(name):
+    # Lowercase wire format, the same bytes a query carries for the name (modulo case)
+    return name.canonicalize().to_wire()
+
+
+class ZoneIndex:
+    """Flat lookup index compiled from a dns.zone.Zone.
+
+    Names are keyed by their lowercase wire format so a query can be looked up straight
+    from its question bytes. Every (name, rdtype) that has an answer, including answers
+    reached through in-zone CNAME chains, is a single dict probe. Misses fall back to
+    the set of existing names (empty non-terminals included) to tell NODATA from
+    NXDOMAIN, and to the wildcard at the closest encloser.
+    """
+
+    def __init__(self, zone):
+        self.origin = wire_key(zone.origin)
+
+        self.rrsets = {}  # {name: {rdtype: [rrset, ...]}}
+        self.answers = {}  # {(name, rdtype): [rrset, ...]}, CNAME chains included
+        self.cname_answers = {}  # {name: [cname rrset, ...]} for types the chain target doesn't have
+        self.compiled = {}  # {name: [rdtype, ...]} answers currently compiled for the name
+        self.names = set()  # every existing name, empty non-terminals included
+        self.children = {}  # {name: number of existing names directly below it}
+        self.wildcards = {}  # {closest encloser: wildcard name}
+        self.cname_sources = {}  # {name: {CNAME owners whose chain goes through it}}
+
+        for name, node in zone.nodes.items():
+            self.load_node(name, node)
+        for key in list(self.rrsets):
+            self.compile(key)
+
+    def lookup(self, key, rdtype, qname=None):
+        answer = self.answers.get((key, rdtype))
+        if answer is not None:
+            return ANSWER, answer
+
+        if key in self.names:
+            # A new name gets its answers just before it exists, it may have got them since the probe above
+            answer = self.answers.get((key, rdtype))
+            if answer is not None:
+                return ANSWER, answer
+            chain = self.cname_answers.get(key)
+            if chain:
+                return ANSWER, chain
+            return NODATA, None
+
+        # Find the closest encloser, if there is none the name isn't in this zone
+        encloser = key
+        while len(encloser) > 1:
+            encloser = encloser[encloser[0] + 1:]
+            if encloser in self.names:
+                break
+        else:
+            return OUT_OF_ZONE, None
+
+        wildcard = self.wildcards.get(encloser)
+        if wildcard is None or qname is None:
+            return NXDOMAIN, None
+
+        rrsets = self.rrsets.get(wildcard, {})
+        sources = rrsets.get(rdtype) or rrsets.get(dns.rdatatype.CNAME)
+        if not sources:
+            return NODATA, None
+
+        synthesized = []
+        for source in sources:
+            rrset = dns.rrset.RRset(qname, source.rdclass, source.rdtype, source.covers)
+            rrset.update(source)
+            synthesized.append(rrset)
+        return WILDCARD, synthesized
+
+    def update(self, zone, name):
+        # Recompile one name after records were added to it. Lookups run meanwhile, so the
+        # steps go in the order that keeps every answer either the old or the new one: a
+        # deleted name stops existing before its answers go, a new one gets its answers
+        # before it exists (no NODATA for it in between)
+        key = wire_key(name)
+        node = zone.get_node(name)
+        if node is None:
+            self.rrsets.pop(key, None)
+            self.prune(key)
+            self.compile(key)
+        else:
+            self.rrsets[key] = self.node_rrsets(name, node)
+            self.compile(key)
+            self.add_name(key)
+
+        for owner in list(self.cname_sources.get(key, ())):
+            self.compile(owner)
+
+    def prune(self, key):
+        # The name was deleted: it and the empty non-terminals above it stop existing,
+        # unless a name below still does
+        while key != self.origin and key in self.names and key not in self.rrsets:
+            if self.children.get(key):
+                break
+            self.names.discard(key)
+            self.children.pop(key, None)
+            if key.startswith(b"\x01*"):
+                self.wildcards.pop(key[2:], None)
+            key = key[key[0] + 1:]
+            self.children[key] -= 1
+
+    def soa(self):
+        return self.rrsets[self.origin][dns.rdatatype.SOA][0]
+
+    def load_node(self, name, node):
+        key = wire_key(name)
+        self.rrsets[key] = self.node_rrsets(name, node)
+        self.add_name(key)
+
+    def node_rrsets(self, name, node):
+        rrsets = {}
+        for rdataset in node.rdatasets:
+            rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype, rdataset.covers)
+            rrset.update(rdataset)
+            rrsets.setdefault(rdataset.rdtype, []).append(rrset)
+        return rrsets
+
+    def add_name(self, key):
+        # The name and every empty non-terminal between it and the origin exist
+        parent = key
+        while parent not in self.names:
+            self.names.add(parent)
+            if parent == self.origin or len(parent) <= 1:
+                break
+            parent = parent[parent[0] + 1:]
+            self.children[parent] = self.children.get(parent, 0) + 1
+
+        if key.startswith(b"\x01*"):
+            self.wildcards[key[2:]] = key
+
+    def compile(self, key):
+        # The new answers are built aside, then each one replaces the old in a single store
+        # and only the types left without an answer are dropped, so there is no moment
+        # where the name has no answers at all
+        rrsets = self.rrsets.get(key) or {}
+        answers = dict(rrsets)  # {rdtype: [rrset, ...]}
+        chain = None
+        if dns.rdatatype.CNAME in rrsets:
+            chain, target = self.follow(key)
+            for rdtype, sets in self.rrsets.get(target, {}).items():
+                if rdtype != dns.rdatatype.CNAME and rdtype not in answers:
+                    answers[rdtype] = chain + sets
+
+        for rdtype, sets in answers.items():
+            self.answers[(key, rdtype)] = sets
+        if chain is not None:
+            self.cname_answers[key] = chain
+        else:
+            self.cname_answers.pop(key, None)
+        for rdtype in self.compiled.get(key, ()):
+            if rdtype not in answers:
+                self.answers.pop((key, rdtype), None)
+
+        if answers:
+            self.compiled[key] = list(answers)
+        else:
+            self.compiled.pop(key, None)
+
+    def follow(self, key):
+        chain = []
+        target = key
+        while len(chain) < MAX_CNAME_CHAIN:
+            cname = self.rrsets.get(target, {}).get(dns.rdatatype.CNAME)
+            if not cname or cname[0] in chain:
+                break
+            chain.append(cname[0])
+            target = wire_key(cname[0][0].target)
+            self.cname_sources.setdefault(target, set()).add(key)
+        return chain, target
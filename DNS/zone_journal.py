@@ -0,0 +1,217 @@
+import os
+import threading
+
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+from DNS.event_log import log
+from DNS.zone_update import ZoneUpdate
+
+
+class Waiter:
+    # A queued write: set once the writer is done with it, with the error if it failed
+    __slots__ = ("done", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class ZoneJournal:
+    """Append-only write-ahead log of zone changes, next to the zone file.
+
+    Each change is a text block appended to `<zone file>.jnl`:
+
+        serial <old> <new>
+        - <record deleted>
+        + <record added>
+        .
+
+    A block without its closing "." was torn by a crash and is ignored. `record` only
+    queues a block; a writer thread takes everything queued while the previous fsync
+    ran and syncs it with one fsync (group commit), so callers that wait for their
+    block without holding a lock share their fsyncs. If the write or the fsync fails,
+    the waiters get the error and the journal is cut back to where it was. After
+    `compact_after` changes the zone is written out as a fresh snapshot of the zone
+    file in the background, and the journal is cut down to what came after it.
+    """
+
+    def __init__(self, zone_file_path, compact_after=1000):
+        self.zone_file_path = zone_file_path
+        self.path = zone_file_path + ".jnl"
+        self.compact_after = compact_after
+        self.pending = 0  # changes appended since the last snapshot
+
+        self.queue = []  # [(block, Waiter), ...] waiting to be written, block None to truncate
+        self.cond = threading.Condition()
+        self.compacting = False
+        self.snapshot_serial = None
+        self.snapshot_lock = threading.Lock()
+
+        self.file = open(self.path, "a")
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def replay(self, zone):
+        # Applies the journal blocks that follow the zone's serial, returns how many were applied
+        if not os.path.exists(self.path):
+            return 0
+        serial = zone.get_rdataset(zone.origin, dns.rdatatype.SOA)[0].serial
+        applied = 0
+        for old, new, lines in self.read_blocks():
+            if old != serial:
+                continue
+            update = ZoneUpdate(zone)
+            for line in lines:
+                name, ttl, rdclass, rdtype, rdata = line[2:].split(None, 4)
+                rrset = dns.rrset.from_text(name, int(ttl), rdclass, rdtype, rdata)
+                if line[0] == "-":
+                    update.delete(rrset)
+                elif rrset.rdtype == dns.rdatatype.SOA:
+                    update.replace(rrset)
+                else:
+                    update.add(rrset)
+            update.commit()
+            serial = new
+            applied += 1
+        self.pending = applied
+        return applied
+
+    def read_blocks(self):
+        with open(self.path) as journal_file:
+            header = None
+            lines = []
+            for line in journal_file:
+                line = line.rstrip("\n")
+                if line.startswith("serial "):
+                    _, old, new = line.split()
+                    header = (int(old), int(new))
+                    lines = []
+                elif line == "." and header is not None:
+                    yield header[0], header[1], lines
+                    header = None
+                elif header is not None:
+                    lines.append(line)
+
+    def record(self, old_soa, new_soa, deleted, added):
+        # Same arguments as IXFRJournal.record. Queues the change in order and returns its
+        # Waiter: wait() returns once the change is on disk, raises if it couldn't be written
+        parts = [f"serial {old_soa[0].serial} {new_soa[0].serial}"]
+        for sign, rrsets in (("-", [old_soa] + deleted), ("+", [new_soa] + added)):
+            for rrset in rrsets:
+                for rd in rrset:
+                    parts.append(f"{sign} {rrset.name} {rrset.ttl} {dns.rdataclass.to_text(rrset.rdclass)} "
+                                 f"{dns.rdatatype.to_text(rrset.rdtype)} {rd.to_text()}")
+        parts.append(".\n")
+
+        waiter = Waiter()
+        with self.cond:
+            self.queue.append(("\n".join(parts), waiter))
+            self.cond.notify()
+        self.pending += 1
+        return waiter
+
+    def write_loop(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                batch, self.queue = self.queue, []
+
+            error = None
+            size = os.fstat(self.file.fileno()).st_size  # everything before this batch is on disk
+            try:
+                for block, _ in batch:
+                    if block is None:
+                        # truncate() reads the journal back from disk, blocks written so far must be there
+                        self.file.flush()
+                        self.truncate()
+                        size = os.fstat(self.file.fileno()).st_size
+                    else:
+                        self.file.write(block)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception as e:
+                log.error("journal", "Error writing zone journal: {}", e)
+                error = e
+                self.rollback(size)
+            for _, waiter in batch:
+                waiter.error = error
+                waiter.done.set()
+
+    def rollback(self, size):
+        # Drops whatever part of a failed batch made it to the file, so replay won't apply
+        # changes that were refused
+        try:
+            self.file.close()
+        except Exception:
+            pass  # the buffered part of the batch is discarded with it
+        try:
+            os.truncate(self.path, size)
+        except Exception as e:
+            log.error("journal", "Error cutting back zone journal: {}", e)
+        self.file = open(self.path, "a")
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_after and not self.compacting
+
+    def compact(self, zone):
+        # Snapshot the zone's current contents (node lists only, rdatasets are never
+        # changed in place) and write it out in the background
+        snapshot = dns.zone.Zone(zone.origin, relativize=False)
+        for name, node in zone.nodes.items():
+            snapshot_node = snapshot.node_factory()
+            snapshot_node.rdatasets = list(node.rdatasets)
+            snapshot.nodes[name] = snapshot_node
+
+        self.compacting = True
+        self.pending = 0
+        threading.Thread(target=self.write_snapshot, args=(snapshot,), daemon=True).start()
+
+    def write_snapshot(self, snapshot):
+        self.snapshot_lock.acquire()
+        try:
+            tmp_path = self.zone_file_path + ".tmp"
+            with open(tmp_path, 'w') as zone_file:
+                snapshot.to_file(zone_file, relativize=False, want_origin=True)
+                zone_file.flush()
+                os.fsync(zone_file.fileno())
+            os.replace(tmp_path, self.zone_file_path)
+
+            self.snapshot_serial = snapshot.get_rdataset(snapshot.origin, dns.rdatatype.SOA)[0].serial
+            waiter = Waiter()
+            with self.cond:
+                self.queue.append((None, waiter))
+                self.cond.notify()
+            waiter.wait()
+            log.info("journal", "Zone snapshot written to {}", self.zone_file_path)
+        except Exception as e:
+            log.error("journal", "Error writing zone snapshot: {}", e)
+        finally:
+            self.compacting = False
+            self.snapshot_lock.release()
+
+    def truncate(self):
+        # Runs on the writer thread: keep only the blocks that follow the snapshot
+        blocks = []
+        keep = False
+        for old, new, lines in self.read_blocks():
+            keep = keep or old == self.snapshot_serial
+            if keep:
+                blocks.append("\n".join([f"serial {old} {new}"] + lines + [".\n"]))
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as journal_file:
+            journal_file.write("".join(blocks))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, "a")
@@ -0,0 +1,119 @@
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+
+
+class ZoneUpdate:
+    """Copy-on-write overlay over a dns.zone.Zone for one update transaction.
+
+    Only the rdatasets a change touches are copied into the overlay; the zone itself is
+    not modified until commit(), so rolling back is just dropping the ZoneUpdate.
+    """
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.overlay = {}  # {(name, rdtype): rdataset}, empty once every record is deleted
+
+    def get(self, name, rdtype):
+        key = (name, rdtype)
+        rdataset = self.overlay.get(key)
+        if rdataset is None:
+            current = self.zone.get_rdataset(name, rdtype)
+            if current is not None:
+                rdataset = current.copy()
+            else:
+                rdataset = dns.rdataset.Rdataset(dns.rdataclass.IN, rdtype)
+            self.overlay[key] = rdataset
+        return rdataset
+
+    def add(self, rrset):
+        rdataset = self.get(rrset.name, rrset.rdtype)
+        rdataset.update_ttl(rrset.ttl)
+        for rd in rrset:
+            rdataset.add(rd)
+
+    def replace(self, rrset):
+        rdataset = self.get(rrset.name, rrset.rdtype)
+        rdataset.clear()
+        self.add(rrset)
+
+    def delete(self, rrset):
+        rdataset = self.get(rrset.name, rrset.rdtype)
+        for rd in rrset:
+            rdataset.discard(rd)
+
+    def delete_rrset(self, name, rdtype):
+        self.get(name, rdtype).clear()
+
+    def delete_name(self, name):
+        node = self.zone.get_node(name)
+        if node is not None:
+            for rdataset in node.rdatasets:
+                self.delete_rrset(name, rdataset.rdtype)
+
+    def bump_serial(self):
+        # Returns the (old, new) SOA rrsets
+        origin = self.zone.origin
+        soa_rdataset = self.get(origin, dns.rdatatype.SOA)
+        old_soa = dns.rrset.RRset(origin, soa_rdataset.rdclass, dns.rdatatype.SOA)
+        old_soa.update(soa_rdataset)
+
+        soa = old_soa[0].replace(serial=(old_soa[0].serial + 1) % 2 ** 32)
+        new_soa = dns.rrset.from_rdata(origin, old_soa.ttl, soa)
+        self.replace(new_soa)
+        return old_soa, new_soa
+
+    def rrsets(self):
+        # Final state of every touched rrset that still has records
+        rrsets = []
+        for (name, rdtype), rdataset in self.overlay.items():
+            if len(rdataset):
+                rrset = dns.rrset.RRset(name, rdataset.rdclass, rdtype)
+                rrset.update(rdataset)
+                rrsets.append(rrset)
+        return rrsets
+
+    def rdtypes(self, name):
+        # Types the name will have after commit
+        node = self.zone.get_node(name)
+        rdtypes = {rdataset.rdtype for rdataset in node.rdatasets} if node is not None else set()
+        for (owner, rdtype), rdataset in self.overlay.items():
+            if owner == name:
+                if len(rdataset):
+                    rdtypes.add(rdtype)
+                else:
+                    rdtypes.discard(rdtype)
+        return rdtypes
+
+    def names(self):
+        return {name for name, _ in self.overlay}
+
+    def diff(self):
+        # ([deleted rrset, ...], [added rrset, ...]) against the zone, SOA left out
+        deleted = []
+        added = []
+        for (name, rdtype), rdataset in self.overlay.items():
+            if rdtype == dns.rdatatype.SOA:
+                continue
+            current = self.zone.get_rdataset(name, rdtype)
+            old = set(current) if current is not None else set()
+            new = set(rdataset)
+            if current is not None and len(rdataset) and current.ttl != rdataset.ttl:
+                # A TTL change rewrites every record of the rrset
+                gone, came = old, new
+            else:
+                gone, came = old - new, new - old
+            if gone:
+                deleted.append(dns.rrset.from_rdata_list(name, current.ttl, list(gone)))
+            if came:
+                added.append(dns.rrset.from_rdata_list(name, rdataset.ttl, list(came)))
+        return deleted, added
+
+    def commit(self):
+        for (name, rdtype), rdataset in self.overlay.items():
+            if len(rdataset):
+                self.zone.replace_rdataset(name, rdataset)
+            else:
+                self.zone.delete_rdataset(name, rdtype)
+        self.overlay = {}
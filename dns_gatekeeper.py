@@ -1,17 +1,44 @@
+import asyncio
+import multiprocessing
+import signal
+import sys
 import dns.message
+import dns.name
 import dns.resolver
+import dns.exception
 import socket
+import struct
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import argparse
 
+from DNS.response_cache import ResponseCache, NegativeAnswer
+from DNS.async_gatekeeper import serve
+from DNS.event_log import log, add_arguments, configure, INFO
+from DNS.ingress_queue import IngressQueue, HIGH, NORMAL, LOW
+from DNS.packet_filter import PacketFilter, OK
+from DNS.upstream_client import UpstreamClient
+from DNS.backend_selector import Backend, BackendSelector
+from DNS.rate_limiter import RateLimiter
+from DNS.response_rate_limiter import ResponseRateLimiter, SEND, SLIP, response_type, truncated_response
+from DNS.wire_codec import question_end
+from DNS.prefix_tree import BanList, format_match, parse_address
+from DNS.shared_table import SharedTable, SharedRateLimiter, SharedBanList
+
 
 class MyDNSGatekeeper:
 
     def __init__(self, primary_ns_host="127.0.0.1", primary_ns_port=31111,
                  secondary_ns_host="127.0.0.1", secondary_ns_port=31112, listen_address="", port=31110,
-                 threshold=100, time_window=5, ban_duration=300):
+                 threshold=100, time_window=5, ban_duration=300, cache_size=10000, cache_min_ttl=0,
+                 negative_cache_size=10000, negative_max_ttl=10800, rrl_rate=10, rrl_window=15, rrl_slip=2,
+                 max_tcp_connections=100, max_tcp_per_ip=4, tcp_idle_timeout=10, tcp_max_duration=60,
+                 queue_size=1000, queue_deadline=1.5, resolve_workers=4,
+                 shed_headroom=0.25,
+                 upstream_timeout=2.0, selection='p2c', retries=1, max_clients=100000,
+                 prefix_v4=24, prefix_v6=48, prefix_threshold=0, escalate_after=4, shared_table=None):
         super().__init__()
         self.primary_ns_host = primary_ns_host
         self.secondary_ns_host = secondary_ns_host
@@ -24,141 +51,434 @@ class MyDNSGatekeeper:
         self.BAN_DURATION = ban_duration
 
 
-        print("threshold is, ", self.THRESHOLD)
+        log.info("config", "threshold is {}", self.THRESHOLD)
+
+        if shared_table is None:
+            # Per-IP token buckets: THRESHOLD queries of burst, refilled at THRESHOLD per TIME_WINDOW
+            self.rate_limiter = RateLimiter(rate=self.THRESHOLD / self.TIME_WINDOW, burst=self.THRESHOLD,
+                                            ban_duration=self.BAN_DURATION, max_clients=max_clients)
 
-        # Track request history and blocked IPs
-        self.history = {}  # {ip: {"count": int, "start_time": float}}
-        self.blocked_ips = {}  # {ip: unblock_time}
+            # Bans for single IPs and whole prefixes, one longest-prefix-match lookup per packet.
+            # Once escalate_after IPs of a /24 (/48 for IPv6) are banned the whole prefix is banned.
+            self.ban_list = BanList(ban_duration=self.BAN_DURATION, prefix_v4=prefix_v4, prefix_v6=prefix_v6,
+                                    escalate_after=escalate_after, max_entries=max_clients)
+        else:
+            # --workers mode: counters and bans live in shared memory so every worker sees them
+            self.rate_limiter = SharedRateLimiter(shared_table, rate=self.THRESHOLD / self.TIME_WINDOW,
+                                                  burst=self.THRESHOLD, ban_duration=self.BAN_DURATION)
+            self.ban_list = SharedBanList(shared_table, ban_duration=self.BAN_DURATION, prefix_v4=prefix_v4,
+                                          prefix_v6=prefix_v6, escalate_after=escalate_after)
+
+        # Optional aggregate limit shared by every address in a prefix
+        self.prefix_limiter = None
+        if prefix_threshold and shared_table is None:
+            self.prefix_limiter = RateLimiter(rate=prefix_threshold / self.TIME_WINDOW, burst=prefix_threshold,
+                                              ban_duration=self.BAN_DURATION, max_clients=max_clients)
+        elif prefix_threshold:
+            self.prefix_limiter = SharedRateLimiter(shared_table, rate=prefix_threshold / self.TIME_WINDOW,
+                                                    burst=prefix_threshold, ban_duration=self.BAN_DURATION,
+                                                    prefix_lengths=self.ban_list.prefix_lengths)
+
+        # One persistent client per backend instead of a new Resolver per query,
+        # picked by latency/health instead of a coin flip
+        self.upstream_timeout = upstream_timeout
+        self.retries = retries
+        self.selector = BackendSelector([
+            Backend("primary", primary_ns_host, primary_ns_port,
+                    UpstreamClient(primary_ns_host, primary_ns_port, timeout=upstream_timeout)),
+            Backend("secondary", secondary_ns_host, secondary_ns_port,
+                    UpstreamClient(secondary_ns_host, secondary_ns_port, timeout=upstream_timeout)),
+        ], strategy=selection)
+
+        # Cache upstream answers so repeated names don't hit primary/secondary
+        self.cache = ResponseCache(max_entries=cache_size, min_ttl=cache_min_ttl)
+        # NXDOMAIN/NODATA answers, kept for the SOA minimum (RFC 2308) so repeated
+        # misses don't reach the backends either
+        self.negative_cache = ResponseCache(max_entries=negative_cache_size, max_ttl=negative_max_ttl)
+
+        # Misses being forwarded right now, so the resolve workers don't forward the same
+        # question twice: identical queries wait for the first one's answer
+        self.inflight = {}  # {(qname, qtype, rdclass): Future}
+        self.inflight_lock = threading.Lock()
+        self.coalesced = 0
+
+        # Response Rate Limiting: over-limit responses (and queries from blocked sources) are
+        # dropped, with a truncated reply now and then so real clients retry over TCP
+        self.rrl = None
+        if rrl_rate > 0:
+            self.rrl = ResponseRateLimiter(rate=rrl_rate, window=rrl_window, slip=rrl_slip, max_entries=max_clients)
+
+        self.rrl_lock = threading.Lock()
+
+        # Drops junk, responses, multi-question packets and opcodes other than QUERY/UPDATE
+        # from the raw bytes, before the rate limiter or dnspython see them
+        self.packet_filter = PacketFilter()
+
+        # Packets wait here between the receive loop and the resolve workers, most
+        # valuable first; sources with less than `shed_headroom` of their burst left go last
+        self.ingress = IngressQueue(max_size=queue_size, deadline=queue_deadline)
+        self.resolve_workers = resolve_workers
+        self.shed_headroom = shed_headroom
+        self.max_clients = max_clients
+        self.verified = OrderedDict()  # {ip: None}, clients that have completed a query over TCP
+        self.verified_lock = threading.Lock()
 
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if shared_table is not None:
+            # Every worker binds the same port, the kernel spreads packets across them
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind((listen_address, port))
 
+        # Where truncated replies send clients
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if shared_table is not None:
+            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.tcp_socket.bind((listen_address, port))
+        self.tcp_socket.listen(64)
+        self.tcp_slots = threading.BoundedSemaphore(max_tcp_connections)
+        # One source can't hold every slot, and a connection is closed after `tcp_idle_timeout`
+        # seconds without a byte or `tcp_max_duration` seconds in all, whichever comes first
+        self.max_tcp_per_ip = max_tcp_per_ip
+        self.tcp_idle_timeout = tcp_idle_timeout
+        self.tcp_max_duration = tcp_max_duration
+        self.tcp_clients = {}  # {ip: open connections}
+        self.tcp_lock = threading.Lock()
 
-    def validate(self, sender_ip):
-        current_time = time.time()
 
-        # Step 1: Check if IP is blocked
-        if sender_ip in self.blocked_ips:
-            if current_time < self.blocked_ips[sender_ip]:  # Still blocked
-                print(f"Blocked request from {sender_ip}")
-                return False
-            else:
-                # Unblock IP after ban duration
-                del self.blocked_ips[sender_ip]
-                print(f"Unblocked IP: {sender_ip}")
-
-        # Step 2: Update request count and check for rate limiting
-        if sender_ip not in self.history:
-            self.history[sender_ip] = {"count": 0, "start_time": current_time}
-
-        # Increment request count
-        self.history[sender_ip]["count"] += 1
-        elapsed_time = current_time - self.history[sender_ip]["start_time"]
-
-        # Check if IP exceeds rate limit
-        if self.history[sender_ip]["count"] > self.THRESHOLD and elapsed_time < self.TIME_WINDOW:
-            print(f"Blocking {sender_ip} for excessive queries.")
-            self.blocked_ips[sender_ip] = current_time + self.BAN_DURATION  # Ban for BAN_DURATION seconds
-            del self.history[sender_ip]  # Remove history for blocked IP
+    def validate(self, sender_ip):
+        now = time.monotonic()
+        bits, address = parse_address(sender_ip)
+
+        # Step 1: Check if the IP or any prefix containing it is banned
+        banned = self.ban_list.lookup(bits, address, now)
+        if banned is not None:
+            log.count(INFO, "blocked", banned, "Blocked {count:,} requests from {key} in last {interval:g}s",
+                      format_match)
             return False
 
-        # Reset count after TIME_WINDOW
-        if elapsed_time >= self.TIME_WINDOW:
-            self.history[sender_ip] = {"count": 1, "start_time": current_time}
+        # Step 2: Per-IP rate limit
+        status = self.rate_limiter.check((bits, address), now)
+        if status == RateLimiter.BLOCKED:
+            log.count(INFO, "blocked", sender_ip, "Blocked {count:,} requests from {key} in last {interval:g}s")
+            return False
 
-        return True
+        if status == RateLimiter.BANNED:
+            # Ban for BAN_DURATION seconds, lifted lazily on the first query after that
+            log.info("ban", "Blocking {} for excessive queries", sender_ip)
+            prefix = self.ban_list.ban(bits, address, now)
+            if prefix is not None:
+                log.info("ban", "Blocking {}, too many banned IPs in it", prefix)
+            return False
 
-    def resolve(self, request):
-        query_name = str(request.question[0].name)
-        query_type = dns.rdatatype.to_text(request.question[0].rdtype)
+        # Step 3: Aggregate rate limit for the whole prefix
+        if self.prefix_limiter is not None:
+            length, prefix = self.ban_list.prefix_of(bits, address)
+            status = self.prefix_limiter.check((bits, prefix), now)
+            if status == RateLimiter.BANNED:
+                log.info("ban", "Blocking {} for excessive queries", self.ban_list.ban_prefix(bits, prefix, length, now))
+            if status != RateLimiter.ALLOWED:
+                return False
 
-        key = uuid.uuid4().int
+        return True
 
+    def rrl_prefix(self, sender_ip):
+        bits, address = parse_address(sender_ip)
+        _, prefix = self.ban_list.prefix_of(bits, address)
+        return bits, prefix
+
+    def allow(self, addr, data, qname, reply, sendto):
+        # RRL check, True if the full response may be sent. Otherwise nothing is sent,
+        # except a truncated reply for every `slip`-th response dropped
+        if self.rrl is None:
+            return True
+        rtype, name = response_type(qname, reply)
+        with self.rrl_lock:
+            verdict = self.rrl.check(self.rrl_prefix(addr[0]), name, rtype)
+        if verdict == SLIP:
+            self.slip(data, addr, sendto)
+        return verdict == SEND
+
+    def blocked(self, addr, data, sendto):
+        # A rejected query gets no answer, but a real client whose address is being
+        # spoofed (and banned) still gets the occasional truncated reply to retry over TCP
+        if self.rrl is None:
+            return
+        with self.rrl_lock:
+            verdict = self.rrl.blocked(self.rrl_prefix(addr[0]))
+        if verdict == SLIP:
+            self.slip(data, addr, sendto)
+
+    def slip(self, data, addr, sendto):
+        response_data = truncated_response(bytes(data))
+        if response_data:
+            sendto(response_data, addr)
+
+    def resolve(self, request, data=None):
         if hasattr(request, 'update') and len(request.update):
             return self.add_record(request)
 
-        if key % 2 == 0:
-            return self.forward_query(query_name, query_type, self.primary_ns_host, self.primary_ns_port)
-        else:
-            return self.forward_query(query_name, query_type, self.secondary_ns_host, self.secondary_ns_port)
+        cache_key = (request.question[0].name, request.question[0].rdtype, request.question[0].rdclass)
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            cached = self.negative_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if data is None:
+            data = request.to_wire()
+
+        with self.inflight_lock:
+            future = self.inflight.get(cache_key)
+            leader = future is None
+            if leader:
+                future = self.inflight[cache_key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            # The leader's own retries bound how long this can take
+            return future.result(timeout=self.upstream_timeout * (self.retries + 1) + 1)
 
-    def forward_query(self, query_name, query_type, host, port):
-        resolver = dns.resolver.Resolver()
-        resolver.port = port
-        resolver.nameservers = [host]
-        return resolver.resolve(query_name, dns.rdatatype.from_text(query_type))
+        try:
+            reply = self.forward_query(data)
+
+            if isinstance(reply, NegativeAnswer):
+                self.negative_cache.put(cache_key, reply)
+            else:
+                self.cache.put(cache_key, reply)
+            future.set_result(reply)
+            return reply
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[cache_key]
+
+    def forward_query(self, data):
+        error = None
+        tried = []
+        for _ in range(self.retries + 1):
+            backend = self.selector.choose(exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+
+            started = self.selector.start(backend)
+            try:
+                # Forward the client's original wire bytes, no need to rebuild the query
+                reply_data = backend.client.query(data)
+            except (dns.exception.Timeout, OSError) as e:
+                # Slow or dead backend, try the other one
+                self.selector.failure(backend, started)
+                error = e
+                continue
+            except BaseException:
+                # Still count it against the backend, or it stays outstanding for good
+                self.selector.failure(backend, started)
+                raise
+            self.selector.success(backend, started)
+
+            reply = dns.message.from_wire(reply_data)
+            negative = NegativeAnswer.from_reply(reply)
+            if negative is not None:
+                return negative
+            if not len(reply.answer):
+                raise dns.resolver.NoAnswer
+            # The whole answer section, a CNAME chain ends in the rrset that was asked for
+            return list(reply.answer)
+
+        raise error
 
     def add_record(self, request):
         update = dns.update.Update(request.zone[0].name)
         address = [rd for rd in request.update[0].items][0].address
         update.add(request.update[0].name, 300, request.update[0].rdtype, address)
         dns.query.udp(update, self.primary_ns_host, port=self.primary_ns_port)
-        print("Added record to Primary nameserver")
+        self.cache.invalidate(request.update[0].name)
+        self.negative_cache.invalidate(request.update[0].name)
+        log.info("update", "Added record to Primary nameserver")
         return request.update[0]
 
-    def reset_history(self):
-        try:
-            while True:
-                time.sleep(self.TIME_WINDOW)  # Reset history periodically
-                self.history = {}
-                print("Reset history done")
-        except KeyboardInterrupt:
-            pass
-
     def run(self):
+        for _ in range(self.resolve_workers):
+            threading.Thread(target=self.resolve_loop, daemon=True).start()
+
+        # Packets are received into one preallocated buffer and only copied out once they
+        # have passed the filter and the rate limiter
+        buf = bytearray(self.packet_filter.max_size + 1)
+        view = memoryview(buf)
         try:
             while True:
-                data, addr = self.socket.recvfrom(4096)
+                length, addr = self.socket.recvfrom_into(buf)
+                if self.packet_filter.check(buf, length) != OK:
+                    continue
                 sender_ip = addr[0]
 
                 # Validate sender IP
                 if not self.validate(sender_ip):
-                    self.socket.sendto("IP banned".encode(), addr)
+                    self.blocked(addr, view[:length], self.socket.sendto)
                     continue
 
-                # Process DNS request
-                try:
-                    request = dns.message.from_wire(data)
-                    reply = self.resolve(request)
-                except Exception as e:
-                    print(f"DNS ERROR: {e}")
-                    continue
+                data = bytes(view[:length])
+                # Queue it for the resolve workers, or shed it if the queue is full of better packets
+                self.ingress.put(self.priority(sender_ip, data), data, addr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.socket.close()
 
-                # Create and send response
-                response = dns.message.make_response(request)
-                if hasattr(reply, 'rrset'):
-                    response.answer.append(reply.rrset)
-                else:
-                    response.answer.append(reply)
-                self.socket.sendto(response.to_wire(), addr)
+    def resolve_loop(self):
+        while True:
+            data, addr = self.ingress.get()
+
+            # Process DNS request
+            try:
+                request = dns.message.from_wire(data)
+                reply = self.resolve(request, data)
+            except Exception as e:
+                log.warning("query_error", "DNS ERROR: {}", e)
+                continue
+
+            # Create and send response
+            if self.allow(addr, data, request.question[0].name, reply, self.socket.sendto):
+                self.socket.sendto(self.make_response(request, reply).to_wire(), addr)
+
+    def priority(self, sender_ip, data):
+        if sender_ip in self.verified:
+            return HIGH
+
+        key = self.question_key(data)
+        if key is not None and (key in self.cache or key in self.negative_cache):
+            return HIGH
+
+        if self.rate_limiter.headroom(parse_address(sender_ip)) < self.shed_headroom:
+            return LOW
+        return NORMAL
+
+    def question_key(self, data):
+        # Cache key read straight from the packet, None if it can't be read
+        end = question_end(data)
+        if end is None:
+            return None
+        name = dns.name.from_wire(data, 12)[0]
+        rdtype, rdclass = struct.unpack_from("!HH", data, end - 4)
+        return name, rdtype, rdclass
+
+    def stats(self):
+        stats = {"filtered": self.packet_filter.stats(), "queue": self.ingress.stats(), "cache": self.cache.stats(),
+                 "negative_cache": self.negative_cache.stats(), "coalesced": self.coalesced}
+        if self.rrl is not None:
+            stats["rrl"] = self.rrl.stats()
+        return stats
+
+    def report_stats(self, interval):
+        while True:
+            time.sleep(interval)
+            log.info("stats", "Stats: {stats}", stats=self.stats())
+
+    def run_tcp(self):
+        while True:
+            try:
+                conn, addr = self.tcp_socket.accept()
+            except OSError as e:
+                log.warning("tcp_error", "TCP accept failed: {}", e)
+                continue
+            if not self.tcp_slots.acquire(blocking=False):
+                conn.close()
+                continue
+            with self.tcp_lock:
+                count = self.tcp_clients.get(addr[0], 0)
+                if count < self.max_tcp_per_ip:
+                    self.tcp_clients[addr[0]] = count + 1
+            if count >= self.max_tcp_per_ip:
+                conn.close()
+                self.tcp_slots.release()
+                continue
+            threading.Thread(target=self.handle_tcp_connection, args=(conn, addr), daemon=True).start()
+
+    def handle_tcp_connection(self, conn, addr):
+        # The handshake proves the source address, so TCP is exempt from RRL; bans and the
+        # per-IP rate limit still apply to every query, and connections are capped
+        deadline = time.monotonic() + self.tcp_max_duration
+        try:
+            while True:
+                header = self.recv_exactly(conn, 2, deadline)
+                if not header:
+                    break
+                data = self.recv_exactly(conn, int.from_bytes(header, "big"), deadline)
+                if not self.validate(addr[0]):
+                    break
+                request = dns.message.from_wire(data)
+                response_data = self.make_response(request, self.resolve(request, data)).to_wire()
+                conn.sendall(len(response_data).to_bytes(2, "big") + response_data)
+                self.verify(addr[0])
+        except Exception as e:
+            log.warning("tcp_error", "TCP connection from {} failed: {}", addr[0], e)
+        finally:
+            conn.close()
+            with self.tcp_lock:
+                count = self.tcp_clients.pop(addr[0]) - 1
+                if count:
+                    self.tcp_clients[addr[0]] = count
+            self.tcp_slots.release()
+
+    def verify(self, ip):
+        # Completing a TCP exchange shows the client really owns its address, so its UDP
+        # queries go first from now on
+        with self.verified_lock:
+            self.verified[ip] = None
+            self.verified.move_to_end(ip)
+            if len(self.verified) > self.max_clients:
+                self.verified.popitem(last=False)
+
+    def recv_exactly(self, conn, count, deadline):
+        # b"" if the connection was closed before anything was read
+        data = b""
+        while len(data) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("connection open too long")
+            conn.settimeout(min(self.tcp_idle_timeout, remaining))
+            chunk = conn.recv(count - len(data))
+            if not chunk:
+                if data:
+                    raise EOFError("connection closed mid-message")
+                break
+            data += chunk
+        return data
+
+    def run_async(self):
+        # Same validate/ban rules as run(), but upstream queries don't block each other
+        try:
+            asyncio.run(serve(self, self.upstream_timeout))
         except KeyboardInterrupt:
             pass
         finally:
             self.socket.close()
 
+    def make_response(self, request, reply):
+        if isinstance(reply, NegativeAnswer):
+            return reply.to_response(request)
+        response = dns.message.make_response(request)
+        if isinstance(reply, list):
+            response.answer.extend(reply)
+        else:
+            response.answer.append(reply)
+        return response
+
     def perform_zone_transfers(self):
         try:
             while True:
                 time.sleep(100)
-                print("Performing a zone transfer")
+                log.info("zone_transfer", "Performing a zone transfer")
                 self.zone_transfer(self.secondary_ns_host, self.secondary_ns_port,
                                    self.primary_ns_host, self.primary_ns_port)
         except KeyboardInterrupt:
             pass
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--port", type=int, default=31110, help="Specify DNS Gatekeeper port")
-    parser.add_argument("--primary_ns_host", default="127.0.0.1", help="Specify primary DNS host")
-    parser.add_argument("--primary_ns_port", type=int, default=31111, help="Specify primary DNS port")
-    parser.add_argument("--secondary_ns_host", default="127.0.0.1", help="Specify secondary DNS host")
-    parser.add_argument("--secondary_ns_port", type=int, default=31112, help="Specify secondary DNS port")
-    parser.add_argument("--threshold", type=int, default=100, help="Max queries allowed in the time window")
-    parser.add_argument("--time_window", type=int, default=5, help="Time window in seconds")
-    parser.add_argument("--ban_duration", type=int, default=300, help="Duration to block IPs (in seconds)")
-    args = parser.parse_args()
-
+def start(args, shared_table=None, zone_transfers=True):
     resolver = MyDNSGatekeeper(
         primary_ns_host=args.primary_ns_host,
         primary_ns_port=args.primary_ns_port,
@@ -168,10 +488,122 @@ if __name__ == "__main__":
         threshold=args.threshold,
         time_window=args.time_window,
         ban_duration=args.ban_duration,
+        cache_size=args.cache_size,
+        cache_min_ttl=args.cache_min_ttl,
+        negative_cache_size=args.negative_cache_size,
+        negative_max_ttl=args.negative_max_ttl,
+        rrl_rate=args.rrl_rate,
+        rrl_window=args.rrl_window,
+        rrl_slip=args.rrl_slip,
+        max_tcp_connections=args.max_tcp_connections,
+        max_tcp_per_ip=args.max_tcp_per_ip,
+        tcp_idle_timeout=args.tcp_idle_timeout,
+        tcp_max_duration=args.tcp_max_duration,
+        queue_size=args.queue_size,
+        queue_deadline=args.queue_deadline,
+        resolve_workers=args.resolve_workers,
+        upstream_timeout=args.upstream_timeout,
+        selection=args.selection,
+        retries=args.retries,
+        max_clients=args.max_clients,
+        prefix_v4=args.prefix_v4,
+        prefix_v6=args.prefix_v6,
+        prefix_threshold=args.prefix_threshold,
+        escalate_after=args.escalate_after,
+        shared_table=shared_table,
     )
 
-    executor = ThreadPoolExecutor(3)
-    executor.submit(resolver.run)
-    executor.submit(resolver.perform_zone_transfers)
-    executor.submit(resolver.reset_history)
+    threading.Thread(target=resolver.run_tcp, daemon=True).start()
+    if args.stats_interval:
+        threading.Thread(target=resolver.report_stats, args=(args.stats_interval,), daemon=True).start()
+
+    executor = ThreadPoolExecutor(1)
+    if zone_transfers:
+        executor.submit(resolver.perform_zone_transfers)
+
+    if args.engine == 'asyncio':
+        resolver.run_async()
+    else:
+        resolver.run()
+
+
+def start_workers(args):
+    # Forked workers inherit the shared table mapping, so it is never attached by name
+    shared_table = SharedTable(slots=args.shared_slots)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=start, args=(args, shared_table, i == 0)) for i in range(args.workers)]
+
+    try:
+        for worker in workers:
+            worker.start()
+        # Make sure the shared memory is unlinked when the pod is stopped, not only on Ctrl+C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        shared_table.close()
+        shared_table.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=31110, help="Specify DNS Gatekeeper port")
+    parser.add_argument("--primary_ns_host", default="127.0.0.1", help="Specify primary DNS host")
+    parser.add_argument("--primary_ns_port", type=int, default=31111, help="Specify primary DNS port")
+    parser.add_argument("--secondary_ns_host", default="127.0.0.1", help="Specify secondary DNS host")
+    parser.add_argument("--secondary_ns_port", type=int, default=31112, help="Specify secondary DNS port")
+    parser.add_argument("--threshold", type=int, default=100, help="Max queries allowed in the time window")
+    parser.add_argument("--time_window", type=int, default=5, help="Time window in seconds")
+    parser.add_argument("--ban_duration", type=int, default=300, help="Duration to block IPs (in seconds)")
+    parser.add_argument("--max_clients", type=int, default=100000, help="Max client IPs tracked by the rate limiter")
+    parser.add_argument("--prefix_v4", type=int, default=24, help="IPv4 prefix length for aggregated limits/bans")
+    parser.add_argument("--prefix_v6", type=int, default=48, help="IPv6 prefix length for aggregated limits/bans")
+    parser.add_argument("--prefix_threshold", type=int, default=0,
+                        help="Max queries per prefix in the time window (0 disables the prefix limit)")
+    parser.add_argument("--escalate_after", type=int, default=4,
+                        help="Ban the whole prefix once this many of its IPs are banned (0 disables)")
+    parser.add_argument("--cache_size", type=int, default=10000, help="Max answers kept in the response cache")
+    parser.add_argument("--cache_min_ttl", type=int, default=0, help="Minimum TTL (in seconds) for cached answers")
+    parser.add_argument("--negative_cache_size", type=int, default=10000,
+                        help="Max NXDOMAIN/NODATA answers kept in the negative cache")
+    parser.add_argument("--negative_max_ttl", type=int, default=10800,
+                        help="Upper bound (in seconds) on how long a negative answer is cached")
+    parser.add_argument("--rrl_rate", type=int, default=10,
+                        help="Responses per second per (client prefix, name, response type), 0 disables RRL")
+    parser.add_argument("--rrl_window", type=int, default=15, help="Seconds of RRL debt an account can build up")
+    parser.add_argument("--rrl_slip", type=int, default=2,
+                        help="Send every Nth rate-limited response truncated (TC=1) instead of dropping it, 0 drops all")
+    parser.add_argument("--max_tcp_connections", type=int, default=100, help="Max TCP connections open at once")
+    parser.add_argument("--max_tcp_per_ip", type=int, default=4, help="Max TCP connections open from one IP")
+    parser.add_argument("--tcp_idle_timeout", type=float, default=10,
+                        help="Close a TCP connection after this many seconds without data")
+    parser.add_argument("--tcp_max_duration", type=float, default=60,
+                        help="Close a TCP connection after this many seconds in all")
+    parser.add_argument("--queue_size", type=int, default=1000, help="Max packets waiting for a resolve worker")
+    parser.add_argument("--queue_deadline", type=float, default=1.5,
+                        help="Drop queued packets older than this (in seconds) instead of answering them")
+    parser.add_argument("--resolve_workers", type=int, default=4, help="Threads answering queued packets")
+    parser.add_argument("--stats_interval", type=float, default=0,
+                        help="Print queue, cache and RRL counters every this many seconds (0 disables)")
+    parser.add_argument("--engine", type=str, choices=['thread', 'asyncio'], default='thread',
+                        help="Select engine: blocking recvfrom loop or asyncio")
+    parser.add_argument("--upstream_timeout", type=float, default=2.0, help="Per-query upstream timeout in seconds")
+    parser.add_argument("--selection", type=str, choices=['p2c', 'round_robin', 'random'], default='p2c',
+                        help="Backend selection strategy")
+    parser.add_argument("--retries", type=int, default=1, help="Retries on the other backend after a timeout")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes sharing the port")
+    parser.add_argument("--shared_slots", type=int, default=262144,
+                        help="Slots in the shared ban/counter table (--workers mode)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
 
+    if args.workers > 1:
+        start_workers(args)
+    else:
+        start(args)
@@ -0,0 +1,78 @@
+import argparse
+import socket
+import ssl
+import threading
+import time
+
+import dns.message
+
+
+def make_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def post(sock_file, sock, query, keep_alive, split_body):
+    connection = b"" if keep_alive else b"Connection: close\r\n"
+    head = (b"POST /dns-query HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/dns-message\r\n" +
+            connection + b"Content-Length: %d\r\n\r\n" % len(query))
+    if split_body:
+        sock.sendall(head)
+        sock.sendall(query)
+    else:
+        sock.sendall(head + query)
+    length = 0
+    while True:
+        line = sock_file.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    return sock_file.read(length)
+
+
+def client(args, context, query, deadline, counts, index):
+    done = 0
+    sock = None
+    while time.time() < deadline:
+        try:
+            if sock is None:
+                sock = context.wrap_socket(socket.create_connection((args.host, args.port)))
+                sock_file = sock.makefile("rb")
+            if post(sock_file, sock, query, args.keep_alive, args.split_body):
+                done += 1
+            if not args.keep_alive:
+                sock.close()
+                sock = None
+        except OSError:
+            sock = None
+    counts[index] = done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent client connections")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--keep_alive', action='store_true', help="Reuse each connection instead of one per request")
+    # The old handler read the head and the body with two recv() calls and hung when
+    # they arrived in the same TLS record
+    parser.add_argument('--split_body', action='store_true', help="Send the body as a separate TLS record")
+    args = parser.parse_args()
+
+    context = make_context()
+    query = dns.message.make_query("ns1.example.com", "A", id=0).to_wire()
+    counts = [0] * args.clients
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=client, args=(args, context, query, deadline, counts, i))
+               for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mode = "keep-alive" if args.keep_alive else "connection per request"
+    print(f"{mode}, {args.clients} clients: {sum(counts) / args.duration:.0f} requests/sec")
@@ -0,0 +1,58 @@
+import argparse
+import socket
+import threading
+import time
+
+import dns.message
+
+
+def receive(sock, stats, stop):
+    while not stop.is_set():
+        try:
+            data = sock.recv(65535)
+        except socket.timeout:
+            continue
+        stats["bytes"] += len(data)
+        stats["packets"] += 1
+        if len(data) >= 12 and data[2] & 0x02:
+            stats["truncated"] += 1
+
+
+if __name__ == '__main__':
+    # Floods the gatekeeper with one query from one source and counts what comes back,
+    # i.e. how much a spoofed flood would reflect onto the victim
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=31110)
+    parser.add_argument('--name', default="ns1.example.com")
+    parser.add_argument('--count', type=int, default=20000, help="Packets to send")
+    parser.add_argument('--rate', type=int, default=2000, help="Packets per second")
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    sock.settimeout(0.2)
+    stats = {"bytes": 0, "packets": 0, "truncated": 0}
+    stop = threading.Event()
+    receiver = threading.Thread(target=receive, args=(sock, stats, stop))
+    receiver.start()
+
+    query = dns.message.make_query(args.name, "A")
+    sent_bytes = 0
+    started = time.time()
+    for i in range(args.count):
+        query.id = i & 0xFFFF
+        wire = query.to_wire()
+        sock.sendto(wire, (args.host, args.port))
+        sent_bytes += len(wire)
+        delay = started + (i + 1) / args.rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    time.sleep(1)
+    stop.set()
+    receiver.join()
+
+    print(f"sent {args.count} packets ({sent_bytes} bytes), got back {stats['packets']} packets "
+          f"({stats['truncated']} truncated), {stats['bytes']} bytes")
+    print(f"{stats['bytes'] / args.count:.2f} bytes back per packet sent, amplification {stats['bytes'] / sent_bytes:.2f}")
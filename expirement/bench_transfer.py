@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import dns.message
+import dns.rdatatype
+import dns.update
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from DNS.dns_handler import MyDNSHandler
+
+KEY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "keys", "primary.pem")
+
+
+def write_zone(path, records):
+    with open(path, "w") as zone_file:
+        zone_file.write("$ORIGIN example.com.\n")
+        zone_file.write("example.com. 3600 IN SOA ns1.example.com. admin.example.com. 1 3600 1800 604800 3600\n")
+        zone_file.write("example.com. 3600 IN NS ns1.example.com.\n")
+        for i in range(records):
+            zone_file.write(f"host{i}.example.com. 3600 IN A 10.{(i >> 16) & 0xFF}.{(i >> 8) & 0xFF}.{i & 0xFF}\n")
+
+
+def transfer(handler, label):
+    request = dns.message.make_query("example.com.", dns.rdatatype.AXFR)
+    begin = time.perf_counter()
+    response = handler.handle_axfr_request(request)
+    elapsed = time.perf_counter() - begin
+    print(f"{label}: {elapsed:.2f} s for {len(response.answer)} records, {handler.signatures.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000, help="Number of A records in the zone")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        zone_path = os.path.join(directory, "bench.zone")
+        write_zone(zone_path, args.records)
+        handler = MyDNSHandler("127.0.0.1", zone_path, KEY_PATH)
+
+        # Without the cache every transfer signs every rrset, which is what the cold transfer does
+        transfer(handler, "cold cache (every rrset signed, as before)")
+        transfer(handler, "warm cache")
+
+        # One dynamic update re-signs the SOA and the changed rrset only
+        update = dns.update.UpdateMessage("example.com.")
+        update.add("new-host", 3600, "A", "192.0.2.1")
+        handler.validate_zone = lambda zone: zone  # the generated zone is unsigned
+        handler.add_record(dns.message.from_wire(update.to_wire()))
+        transfer(handler, "after one update")
@@ -2,21 +2,31 @@ import argparse
 from DNS.udp_dns_handler import MyUDPDNSHandler
 from DNS.ssl_dns_handler import MySSLDNSHandler
 from DNS.https_dns_handler import MyHTTPSDNSHandler
+from DNS.event_log import add_arguments, configure
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=31111, help="Specify DNS port")
     parser.add_argument("--zone_file", default="zones/primary.zone", help="Specify zone file")
     parser.add_argument("--private_key_path", default="keys/primary.pem", help="Specify private key file")
+    parser.add_argument("--validation_workers", type=int, default=None, help="Processes used to validate transferred zones (default: one per CPU)")
+    parser.add_argument("--forward_workers", type=int, default=8, help="Threads answering UDP queries for names outside the zone")
+    parser.add_argument("--max_connections", type=int, default=1000, help="Maximum open DoT/DoH connections")
+    parser.add_argument("--idle_timeout", type=float, default=10, help="Seconds before an idle DoT/DoH connection is closed")
     parser.add_argument("--mode", type=str, choices=['udp', 'ssl', 'https'], default='udp', help="Select mode: udp, ssl, or https")
 
+    add_arguments(parser)
     args = parser.parse_args()
+    configure(args)
     if args.mode == 'https':
-        resolver = MyHTTPSDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path)
+        resolver = MyHTTPSDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path, validation_workers=args.validation_workers,
+                                     max_connections=args.max_connections, idle_timeout=args.idle_timeout)
     elif args.mode == 'ssl':
-        resolver = MySSLDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path)
+        resolver = MySSLDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path, validation_workers=args.validation_workers,
+                                   max_connections=args.max_connections, idle_timeout=args.idle_timeout)
     else:
-        resolver = MyUDPDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path)
+        resolver = MyUDPDNSHandler(port=args.port, zone_file_path=args.zone_file, private_key_path=args.private_key_path, validation_workers=args.validation_workers,
+                                   forward_workers=args.forward_workers)
 
     resolver.run()
 